@@ -1,17 +1,42 @@
+import sys
+
 import streamlit as st
-from pages import company, location  # Importing your page modules
-from utils.utils_home import *
+from pages import PAGES, load_page  # Page modules are imported on first visit
+from utils.chart_tasks import build_charts, task
+from utils.data_store import DATA_PATH, source_version
+from utils import profiling, warmup
+
+# Streamlit puts the script path at the front of sys.path for each rerun and takes
+# it out afterwards, so concurrent sessions reshuffle sys.path while others walk it
+# for imports and package metadata (which then miss site-packages). A permanent
+# copy at the end keeps it in sys.path, and Streamlit stops adding and removing it.
+if sys.path[-1] != __file__:
+    sys.path.append(__file__)
 
 # Set page configuration
 st.set_page_config(page_title="Eco Emissions Insights", page_icon="🌿", layout="wide")
 
 # Sidebar navigation
 st.sidebar.title('Navigation')
-selection = st.sidebar.radio("Go to", ['Home', 'Company Insights', 'Location Insights'])
+selection = st.sidebar.radio("Go to", ['Home'] + list(PAGES))
+
+# Warm the shared caches in the background (a no-op when python -m utils.warmup
+# --serve already started it) so later sessions find them built
+warmup.start(DATA_PATH)
+
+# Timing hooks: ?debug=1 (or EMISSIONS_PROFILE=1) shows the performance panel
+profiling.start_rerun(debug=st.query_params.get('debug') == '1')
 
 # Main page content
+@profiling.profiled
 def main():
-    data = load_data('data/Processed_Unit.csv')
+    # Plotly is only loaded once the Home page is actually shown
+    from utils.utils_home import (create_emissions_trend_chart, create_state_wise_emissions_map,
+                                  create_top_emitters_bar_chart, create_top_sectors_pie_chart, load_aggregates)
+
+    aggregates = load_aggregates(DATA_PATH)
+    # Home has no filters, so the dataset version alone identifies its charts
+    version = source_version(DATA_PATH)
 
     # Introduction section
     st.header("Empowering you to make a difference ✨")
@@ -24,22 +49,26 @@ def main():
     st.subheader("Navigate through complex emissions data with ease 🌉")
     st.markdown("Making it simple to understand the impact in your area")
 
+    # The four charts are independent, so build them concurrently
+    top_sectors_chart, emissions_trend_chart, state_wise_emissions_map, top_emitters_bar_chart = build_charts(
+        task(create_top_sectors_pie_chart, aggregates, cache_key=version),
+        task(create_emissions_trend_chart, aggregates, cache_key=version),
+        task(create_state_wise_emissions_map, aggregates, cache_key=version),
+        task(create_top_emitters_bar_chart, aggregates, cache_key=version),
+    )
+
     # Visualizations in a grid layout
     with st.container():
         col1, col2 = st.columns(2)
         with col1:
-            top_sectors_chart = create_top_sectors_pie_chart(data)
             st.plotly_chart(top_sectors_chart, use_container_width=True)
         with col2:
-            emissions_trend_chart = create_emissions_trend_chart(data)
             st.plotly_chart(emissions_trend_chart, use_container_width=True)
 
         col3, col4 = st.columns(2)
         with col3:
-            state_wise_emissions_map = create_state_wise_emissions_map(data)
             st.plotly_chart(state_wise_emissions_map, use_container_width=True)
         with col4:
-            top_emitters_bar_chart = create_top_emitters_bar_chart(data)
             st.plotly_chart(top_emitters_bar_chart, use_container_width=True)
 
     # Key Features section
@@ -74,7 +103,7 @@ def main():
 # Routing logic
 if selection == 'Home':
     main()
-elif selection == 'Company Insights':
-    company.show()  # Assuming each page module has a show function
-elif selection == 'Location Insights':
-    location.show()
+else:
+    load_page(selection).show()  # Each page module has a show function
+
+profiling.render_debug_panel()
@@ -0,0 +1,434 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['Home', 'Company Insights', 'Location Insights']
+EMISSION_TYPES = ['CO2', 'CH4', 'N2O']
+YEARS = (2010, 2022)
+DEFAULT_SESSIONS = '1,4,8'
+# The shared runtime below patches Streamlit internals that were only checked
+# against these releases
+SUPPORTED_STREAMLIT = ('1.31',)
+
+
+def check_streamlit():
+    import streamlit
+
+    if not streamlit.__version__.startswith(tuple(release + '.' for release in SUPPORTED_STREAMLIT)):
+        sys.exit(f'load_test drives Streamlit {", ".join(SUPPORTED_STREAMLIT)} internals, found '
+                 f'{streamlit.__version__}; check _share_runtime against it and update SUPPORTED_STREAMLIT')
+    return streamlit.__version__
+
+
+# AppTest installs a mock Runtime for the length of each run and removes it
+# afterwards, which breaks any other session running at the same time. Pin one
+# shared mock runtime for the whole process so sessions can overlap the way
+# they do on a real server.
+def _share_runtime():
+    from unittest.mock import MagicMock
+
+    check_streamlit()
+    try:
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+        from streamlit.runtime.media_file_manager import MediaFileManager
+        from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    except ImportError as exc:
+        sys.exit(f'Streamlit internals used by the shared runtime moved: {exc}')
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak rather than current RSS where /proc is not available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Process RSS every interval seconds, as [elapsed_s, rss_mb] pairs
+class RssSampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+        self._origin = time.perf_counter()
+
+    def run(self):
+        while not self._done.is_set():
+            self.samples.append([round(time.perf_counter() - self._origin, 3), round(rss_mb(), 1)])
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.samples.append([round(time.perf_counter() - self._origin, 3), round(rss_mb(), 1)])
+
+
+# Facility names to type into the Company page, read straight from the data
+# so any revision of the app can be driven with the same inputs
+def facility_names(path):
+    import pandas as pd
+
+    if os.path.isdir(path):
+        names = pd.read_parquet(os.path.join(path, '_facilities.parquet'), columns=['Facility.Name'])
+    elif path.endswith('.parquet'):
+        names = pd.read_parquet(path, columns=['Facility.Name'])
+    else:
+        names = pd.read_csv(path, usecols=['Facility.Name'])
+    return sorted(names['Facility.Name'].dropna().astype(str).unique())
+
+
+def _widget(elements, label):
+    return next((element for element in elements if element.label == label), None)
+
+
+# One simulated user: an AppTest session moving between pages and changing
+# their inputs. Every rerun is timed and recorded as (page, action, seconds, error).
+class Session:
+    def __init__(self, app_path, names, rng, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(app_path, default_timeout=timeout)
+        self.names = names
+        self.rng = rng
+        self.page = 'Home'
+        self.samples = []
+        self._rerun('Home', 'open', self.app.run)
+
+    def _rerun(self, page, action, run):
+        start = time.perf_counter()
+        error = None
+        try:
+            run()
+            if self.app.exception:
+                error = str(self.app.exception[0].value)[:200]
+        except Exception as exc:
+            error = f'{type(exc).__name__}: {exc}'[:200]
+        self.samples.append((page, action, time.perf_counter() - start, error))
+        return error is None
+
+    def _go(self, page):
+        if page == self.page:
+            return True
+        self.page = page
+        return self._rerun(page, 'navigate', lambda: self.app.sidebar.radio[0].set_value(page).run())
+
+    def home(self):
+        if self.page == 'Home':
+            self._rerun('Home', 'refresh', self.app.run)
+        else:
+            self._go('Home')
+
+    # Random company query (a full name, or one word of it for a broad match),
+    # year range and gas
+    def company(self):
+        if not self._go('Company Insights'):
+            return
+        sidebar = self.app.sidebar
+        name = self.rng.choice(self.names)
+        query = name if self.rng.random() < 0.7 else self.rng.choice(name.split())
+        start = self.rng.randint(*YEARS)
+        changes = [(_widget(sidebar.text_input, 'Company Name'), query),
+                   (_widget(sidebar.slider, 'Select a date range'), (start, self.rng.randint(start, YEARS[1]))),
+                   (_widget(sidebar.selectbox, 'Select emission type'), self.rng.choice(EMISSION_TYPES))]
+        for widget, value in changes:
+            if widget is not None:
+                widget.set_value(value)
+        self._rerun('Company Insights', 'filter', self.app.run)
+
+    # Random state, then a random city of that state
+    def location(self):
+        if not self._go('Location Insights'):
+            return
+        for label in ['State', 'City']:
+            widget = _widget(self.app.sidebar.selectbox, label)
+            if widget is None or not widget.options:
+                return
+            value = self.rng.choice(widget.options)
+            if not self._rerun('Location Insights', label.lower(), lambda: widget.set_value(value).run()):
+                return
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    by_page = {}
+    for page, action, seconds, error in samples:
+        entry = by_page.setdefault(page, {'latencies': [], 'errors': 0, 'actions': {}, 'messages': {}})
+        entry['latencies'].append(seconds)
+        entry['errors'] += error is not None
+        if error is not None:
+            entry['messages'][error] = entry['messages'].get(error, 0) + 1
+        entry['actions'][action] = entry['actions'].get(action, 0) + 1
+    summary = {}
+    for page, entry in by_page.items():
+        latencies = entry['latencies']
+        summary[page] = {
+            'reruns': len(latencies),
+            'errors': entry['errors'],
+            'error_messages': entry['messages'],
+            'actions': entry['actions'],
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            **{f'p{q}_ms': _percentile(latencies, q) * 1000 for q in (50, 90, 95, 99)},
+            'max_ms': max(latencies) * 1000,
+        }
+    return summary
+
+
+# Drive `sessions` concurrent users against app_path for `duration` seconds in
+# this process, which plays the part of one app replica
+def run_worker(app_root, data_path, sessions, duration, think, ramp, seed, weights, timeout, sample_interval):
+    sys.path.insert(0, app_root)
+    os.chdir(app_root)
+    _share_runtime()
+
+    names = facility_names(data_path)
+    pages = list(weights)
+    sampler = RssSampler(sample_interval)
+    sampler.start()
+    started = time.perf_counter()
+    deadline = started + duration
+    users, errors = [], []
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        time.sleep(ramp * index / max(sessions, 1))
+        try:
+            session = Session(os.path.join(app_root, 'app.py'), names, rng, timeout)
+        except Exception as exc:
+            errors.append(f'{type(exc).__name__}: {exc}'[:200])
+            return
+        users.append(session)
+        actions = {'Home': session.home, 'Company Insights': session.company, 'Location Insights': session.location}
+        while time.perf_counter() < deadline:
+            actions[rng.choices(pages, weights=[weights[page] for page in pages])[0]]()
+            if think:
+                time.sleep(rng.uniform(0, think))
+
+    threads = [threading.Thread(target=user, args=(index,), name=f'load-session-{index}') for index in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - started
+    sampler.stop()
+
+    samples = [sample for session in users for sample in session.samples]
+    rss = [value for _, value in sampler.samples]
+    return {
+        'sessions': sessions,
+        'wall_s': wall_s,
+        'reruns': len(samples),
+        'reruns_per_s': len(samples) / wall_s,
+        'session_errors': errors,
+        'pages': summarize(samples),
+        'rss_mb': {'start': rss[0], 'peak': max(rss), 'end': rss[-1], 'timeline': sampler.samples},
+    }
+
+
+def _git(args, cwd=ROOT):
+    return subprocess.run(['git'] + args, cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+
+
+# Run every concurrency level in a fresh process so caches and RSS start from
+# scratch, against the app checked out at app_root
+def run(app_root, data_path, levels, args):
+    streamlit_version = check_streamlit()
+    report = {
+        'revision': _git(['rev-parse', 'HEAD'], cwd=app_root) if os.path.exists(os.path.join(app_root, '.git')) else None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'streamlit': streamlit_version,
+        'platform': platform.platform(),
+        'data': data_path,
+        'duration_s': args.duration,
+        'think_s': args.think,
+        'levels': {},
+    }
+    for sessions in levels:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as out:
+            out_path = out.name
+        env = dict(os.environ, EMISSIONS_DATA_PATH=data_path)
+        command = [sys.executable, '-W', 'ignore::FutureWarning', os.path.abspath(__file__), '--worker', app_root,
+                   '--sessions', str(sessions), '--duration', str(args.duration), '--think', str(args.think),
+                   '--ramp', str(args.ramp), '--seed', str(args.seed), '--weights', args.weights,
+                   '--timeout', str(args.timeout), '--sample-interval', str(args.sample_interval), '--output', out_path]
+        subprocess.run(command, cwd=app_root, env=env, check=True)
+        with open(out_path) as f:
+            result = json.load(f)
+        os.remove(out_path)
+        report['levels'][str(sessions)] = result
+        print(format_level(result), file=sys.stderr)
+    return report
+
+
+def format_level(result):
+    lines = [f'{result["sessions"]} sessions: {result["reruns"]} reruns in {result["wall_s"]:.1f}s '
+             f'({result["reruns_per_s"]:.1f}/s), RSS {result["rss_mb"]["start"]:.0f} -> '
+             f'{result["rss_mb"]["peak"]:.0f} MB peak']
+    for page, stats in result['pages'].items():
+        lines.append(f'    {page:<18} n={stats["reruns"]:<5} p50 {stats["p50_ms"]:8.1f} ms  p90 {stats["p90_ms"]:8.1f} ms  '
+                     f'p99 {stats["p99_ms"]:8.1f} ms  max {stats["max_ms"]:8.1f} ms  errors {stats["errors"]}')
+        # Errors gate comparisons, so show what they were
+        for message, count in sorted(stats.get('error_messages', {}).items(), key=lambda item: -item[1])[:5]:
+            lines.append(f'        {count:>4} x {message}')
+    for message in result.get('session_errors', []):
+        lines.append(f'    session failed to start: {message}')
+    return '\n'.join(lines)
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return f'{"-":>24}'
+    delta = f'{(new - old) / old * 100:+.0f}%' if old else 'n/a'
+    return f'{old:9.1f} -> {new:9.1f} {delta:>6}'
+
+
+# Side-by-side latency percentiles, throughput and RSS of two reports, plus
+# the (level, page, metric) cases whose p90/p99 grew by more than tolerance
+def compare(base, new, tolerance):
+    lines = [f'base {base.get("revision") or "?"}  vs  new {new.get("revision") or "?"}']
+    if base.get('streamlit') and new.get('streamlit') and base['streamlit'] != new['streamlit']:
+        lines.append(f'warning: Streamlit {base["streamlit"]} vs {new["streamlit"]}, latencies are not comparable')
+    regressions = []
+    common = False
+    for level, new_result in new['levels'].items():
+        base_result = base['levels'].get(level)
+        if base_result is None:
+            continue
+        common = True
+        lines.append(f'{level} sessions')
+        lines.append(f'    {"reruns/s":<24} {_change(base_result["reruns_per_s"], new_result["reruns_per_s"])}')
+        lines.append(f'    {"peak RSS MB":<24} {_change(base_result["rss_mb"]["peak"], new_result["rss_mb"]["peak"])}')
+        for page, stats in new_result['pages'].items():
+            old = base_result['pages'].get(page, {})
+            for metric in ['p50_ms', 'p90_ms', 'p99_ms']:
+                lines.append(f'    {page + " " + metric[:3]:<24} {_change(old.get(metric), stats[metric])}')
+                if metric != 'p50_ms' and old.get(metric) and stats[metric] > old[metric] * (1 + tolerance):
+                    regressions.append((level, page, metric, old[metric], stats[metric]))
+            if stats['errors'] > old.get('errors', 0):
+                regressions.append((level, page, 'errors', old.get('errors', 0), stats['errors']))
+    if not common:
+        lines.append('no concurrency level in common')
+    return '\n'.join(lines), regressions
+
+
+# A detached worktree of revision, removed when the block exits
+class _Checkout:
+    def __init__(self, revision):
+        self.revision = revision
+        self.path = tempfile.mkdtemp(prefix='emissions-load-')
+
+    def __enter__(self):
+        os.rmdir(self.path)
+        _git(['worktree', 'add', '--detach', self.path, self.revision])
+        return self.path
+
+    def __exit__(self, *exc):
+        subprocess.run(['git', 'worktree', 'remove', '--force', self.path], cwd=ROOT, capture_output=True)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _print_comparison(base, new, tolerance):
+    text, regressions = compare(base, new, tolerance)
+    print(text)
+    for level, page, metric, old, value in regressions:
+        print(f'REGRESSION {level} sessions {page} {metric}: {old:.1f} -> {value:.1f}', file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate concurrent dashboard sessions against one app process')
+    parser.add_argument('--sessions', default=DEFAULT_SESSIONS, help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=30, help='seconds each level runs')
+    parser.add_argument('--think', type=float, default=0.5, help='most seconds a user waits between actions')
+    parser.add_argument('--ramp', type=float, default=2, help='seconds over which sessions start')
+    parser.add_argument('--weights', default='Home=1,Company Insights=2,Location Insights=2',
+                        help='relative frequency of each page')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds before a rerun counts as failed')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='seconds between RSS samples')
+    parser.add_argument('--data', help='dataset to serve (default: EMISSIONS_DATA_PATH or data/Processed_Unit.csv)')
+    parser.add_argument('--size', help='generate a synthetic dataset of this many rows instead, e.g. 100k')
+    parser.add_argument('--output', default='load_test.json')
+    parser.add_argument('--revisions', nargs=2, metavar=('BASE', 'NEW'), help='git revisions to run and compare')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE_JSON', 'NEW_JSON'), help='compare two earlier reports')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative p90/p99 slowdown')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    weights = {page: float(weight) for page, weight in (item.split('=') for item in args.weights.split(','))}
+
+    if args.worker:
+        result = run_worker(args.worker, os.environ['EMISSIONS_DATA_PATH'], int(args.sessions), args.duration,
+                            args.think, args.ramp, args.seed, weights, args.timeout, args.sample_interval)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            regressions = _print_comparison(json.load(f), json.load(g), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+    check_streamlit()
+    if args.size:
+        from benchmarks.synthetic_data import generate, parse_size
+
+        data_path = os.path.join(tempfile.gettempdir(), f'Processed_Unit_{args.size}.csv')
+        if not os.path.exists(data_path):
+            generate(data_path, parse_size(args.size))
+    else:
+        data_path = args.data or os.environ.get('EMISSIONS_DATA_PATH', os.path.join(ROOT, 'data/Processed_Unit.csv'))
+    data_path = os.path.abspath(data_path)
+    levels = [int(level) for level in args.sessions.split(',')]
+
+    if not args.revisions:
+        report = run(ROOT, data_path, levels, args)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        return
+
+    reports = []
+    for revision in args.revisions:
+        with _Checkout(revision) as checkout:
+            print(f'== {revision}', file=sys.stderr)
+            # Early revisions read data/Processed_Unit.csv rather than EMISSIONS_DATA_PATH
+            default_path = os.path.join(checkout, 'data', 'Processed_Unit.csv')
+            if not os.path.exists(default_path) and os.path.isfile(data_path):
+                os.makedirs(os.path.dirname(default_path), exist_ok=True)
+                os.symlink(data_path, default_path)
+            reports.append(run(checkout, data_path, levels, args))
+    with open(args.output, 'w') as f:
+        json.dump({'base': reports[0], 'new': reports[1]}, f, indent=2)
+    sys.exit(1 if _print_comparison(*reports, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
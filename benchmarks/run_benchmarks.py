@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic_data import generate, parse_size
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = '10k,100k,1M,10M'
+PAGES = ['Home', 'Company Insights', 'Location Insights']
+
+
+# Median/min wall time over repeats, then one traced run for peak Python/NumPy memory
+def measure(fn, repeats, setup=None):
+    times = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'repeats': repeats, 'peak_mb': peak / 2 ** 20}
+
+
+def _remove_artifacts(path):
+    from utils.data_store import artifact_path
+
+    parquet_path = artifact_path(path, '.parquet')
+    if os.path.exists(parquet_path):
+        os.remove(parquet_path)
+
+
+# Run every case against one dataset; executed in a fresh process per size so
+# peak RSS and module-level caches are not shared between sizes
+def run_worker(path, repeats):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from streamlit.testing.v1 import AppTest
+    from utils import aggregates, data_store, utils_company, utils_home, utils_location
+    from utils.figure_cache import figure_cache
+
+    results = {}
+
+    def case(name, fn, setup=None):
+        results[name] = measure(fn, repeats, setup)
+
+    def cold_load():
+        data_store.clear()
+        _remove_artifacts(path)
+
+    case('data_store.load_csv', lambda: data_store.get_data(path), setup=cold_load)
+    case('data_store.load_parquet', lambda: data_store.get_data(path), setup=data_store.clear)
+    data = data_store.get_data(path)
+
+    company, date_range, gas = 'ENERGY', (2010, 2022), 'CO2'
+    case('utils_company.select_company', lambda: utils_company.select_company(data, company))
+    case('utils_company.filter_data', lambda: utils_company.filter_data(data, company, date_range, gas))
+    company_rows, filtered = utils_company.filter_data(data, company, date_range, gas)
+    case('utils_company.pivot_data', lambda: utils_company.pivot_data(filtered, gas))
+    case('utils_company.calculate_sector_data',
+         lambda: utils_company.calculate_sector_data(company_rows, data, company, gas))
+    case('utils_company.calculate_metrics', lambda: utils_company.calculate_metrics(company_rows, gas))
+    case('utils_company.analyze_company', lambda: utils_company.analyze_company(data, company, date_range, gas),
+         setup=utils_company.clear_analysis_cache)
+
+    state = data['State'].value_counts().index[0]
+    case('utils_location.filter_data', lambda: utils_location.filter_data(data, state=state))
+    state_rows = utils_location.filter_data(data, state=state)
+    for name in ['build_co2_emissions_by_year', 'build_emissions_distribution',
+                 'build_emissions_by_sector', 'build_dynamic_scatter']:
+        build = getattr(utils_location, name)
+        case(f'utils_location.{name}', lambda build=build: build(state_rows))
+
+    case('aggregates.build_aggregates', lambda: aggregates.build_aggregates(data))
+    rollups = aggregates.get_aggregates(path)
+    for name in ['create_top_sectors_pie_chart', 'create_emissions_trend_chart',
+                 'create_state_wise_emissions_map', 'create_top_emitters_bar_chart']:
+        create = getattr(utils_home, name)
+        case(f'utils_home.{name}', lambda create=create: create(rollups))
+
+    # Full page runs through Streamlit's headless test runner, with the
+    # figure and analysis caches emptied so each run does its data work
+    def clear_caches():
+        figure_cache.clear()
+        utils_company.clear_analysis_cache()
+
+    for page in PAGES:
+        def run_page(page=page):
+            app = AppTest.from_file('app.py', default_timeout=600)
+            app.run()
+            if page != 'Home':
+                app.sidebar.radio[0].set_value(page).run()
+            if app.exception:
+                raise RuntimeError(f'{page}: {app.exception[0].value}')
+        case(f'page.{page}', run_page, setup=clear_caches)
+
+    return {
+        'rows': len(data),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'cases': results,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeats, data_dir):
+    report = {
+        'revision': _git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': {},
+    }
+    for size in sizes:
+        n_rows = parse_size(size)
+        path = os.path.join(data_dir, f'Processed_Unit_{size}.csv')
+        if not os.path.exists(path):
+            print(f'generating {n_rows:,} rows -> {path}', file=sys.stderr)
+            generate(path, n_rows)
+
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as out:
+            out_path = out.name
+        env = dict(os.environ, EMISSIONS_DATA_PATH=path)
+        subprocess.run([sys.executable, '-m', 'benchmarks.run_benchmarks', '--worker', path,
+                        '--repeats', str(repeats), '--output', out_path], cwd=ROOT, env=env, check=True)
+        with open(out_path) as f:
+            report['sizes'][size] = json.load(f)
+        os.remove(out_path)
+
+        for name, result in report['sizes'][size]['cases'].items():
+            print(f'{size:>6} {name:<55} {result["median_s"] * 1000:10.1f} ms {result["peak_mb"]:9.1f} MB')
+    return report
+
+
+# Cases whose median time grew by more than tolerance relative to the baseline
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for size, result in report['sizes'].items():
+        old_cases = baseline.get('sizes', {}).get(size, {}).get('cases', {})
+        for name, case in result['cases'].items():
+            old = old_cases.get(name)
+            if old and case['median_s'] > old['median_s'] * (1 + tolerance):
+                regressions.append((size, name, old['median_s'], case['median_s']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the emissions data pipeline on synthetic data')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated row counts, e.g. 10k,100k')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--data-dir', default=tempfile.gettempdir(), help='where synthetic datasets are kept')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.output, 'w') as f:
+            json.dump(run_worker(args.worker, args.repeats), f)
+        return
+
+    report = run(args.sizes.split(','), args.repeats, args.data_dir)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for size, name, old, new in regressions:
+            print(f'REGRESSION {size} {name}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
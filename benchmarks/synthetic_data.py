@@ -0,0 +1,88 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+SECTORS = [
+    'Power Plants', 'Petroleum and Natural Gas Systems', 'Refineries', 'Chemicals', 'Minerals',
+    'Waste', 'Metals', 'Pulp and Paper', 'Government', 'Other', 'Suppliers of CO2',
+    'Import and Export of Equipment Containing Fluorintaed GHGs',
+]
+STATES = [
+    'TX', 'LA', 'CA', 'PA', 'OH', 'IL', 'IN', 'OK', 'FL', 'MI', 'NY', 'GA', 'AL', 'KY', 'WV',
+    'NM', 'CO', 'ND', 'WY', 'KS', 'MO', 'MN', 'WI', 'IA', 'NC', 'SC', 'TN', 'VA', 'AR', 'MS',
+    'UT', 'AZ', 'NV', 'MT', 'NE', 'WA', 'OR', 'ID', 'SD', 'NJ', 'MD', 'MA', 'CT', 'ME', 'NH',
+    'VT', 'RI', 'DE', 'DC', 'AK', 'HI', 'PR',
+]
+NAME_WORDS = ['ENERGY', 'POWER', 'CHEMICAL', 'REFINING', 'STEEL', 'CEMENT', 'GAS', 'LANDFILL',
+              'PAPER', 'MIDSTREAM', 'GENERATING', 'PLANT', 'STATION', 'COMPRESSOR', 'PROCESSING']
+NAME_SUFFIXES = ['LLC', 'INC.', 'CO.', 'CORP.', 'LP', 'LTD.', 'FACILITY', 'WORKS']
+YEARS = np.arange(2010, 2023)
+
+
+def parse_size(size):
+    size = str(size).strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(size[-1], 1)
+    return int(float(size.rstrip('km')) * multiplier)
+
+
+# Facilities with realistic cardinalities: a few thousand names spread over
+# skewed states and sectors, one city and state per facility
+def _facilities(n_rows, rng):
+    n_facilities = int(np.clip(n_rows // 40, 200, 20_000))
+    n_cities = max(50, n_facilities // 3)
+
+    state_weights = 1.0 / np.arange(1, len(STATES) + 1) ** 0.8
+    sector_weights = 1.0 / np.arange(1, len(SECTORS) + 1)
+    words = rng.choice(NAME_WORDS, size=(n_facilities, 2))
+    suffixes = rng.choice(NAME_SUFFIXES, size=n_facilities)
+    names = [f'{a} {b} {i} {suffix}' for i, ((a, b), suffix) in enumerate(zip(words, suffixes))]
+    names[0] = 'ABBVIE LTD.'
+
+    return pd.DataFrame({
+        'Facility.Name': names,
+        'City': [f'CITY {i}' for i in rng.integers(0, n_cities, n_facilities)],
+        'State': rng.choice(STATES, size=n_facilities, p=state_weights / state_weights.sum()),
+        'Sector': rng.choice(SECTORS, size=n_facilities, p=sector_weights / sector_weights.sum()),
+        'scale': rng.lognormal(10, 2, n_facilities),
+    })
+
+
+def _rows(facilities, n_rows, rng):
+    # Large facilities report more units, so rows are drawn proportionally to size
+    weights = np.sqrt(facilities['scale'].to_numpy())
+    picks = rng.choice(len(facilities), size=n_rows, p=weights / weights.sum())
+    rows = facilities.iloc[picks].reset_index(drop=True)
+    scale = rows.pop('scale').to_numpy()
+
+    co2 = scale * rng.lognormal(0, 0.5, n_rows)
+    ch4 = co2 * rng.lognormal(-7, 1.5, n_rows)
+    n2o = co2 * rng.lognormal(-9, 1.5, n_rows)
+    rows['Year'] = rng.choice(YEARS, size=n_rows)
+    rows['CO2_emissions'] = co2.round(1)
+    rows['CH4_emissions'] = ch4.round(3)
+    rows['N2O_emissions'] = n2o.round(3)
+    rows['CO2_eq_emissions'] = (co2 + 25 * ch4 + 298 * n2o).round(1)
+    return rows
+
+
+# Write a Processed_Unit.csv-shaped file with n_rows rows, in chunks so large
+# sizes don't need the whole table in memory
+def generate(path, n_rows, seed=0, chunk_rows=1_000_000):
+    rng = np.random.default_rng(seed)
+    facilities = _facilities(n_rows, rng)
+    written = 0
+    while written < n_rows:
+        chunk = _rows(facilities, min(chunk_rows, n_rows - written), rng)
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += len(chunk)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Processed_Unit.csv')
+    parser.add_argument('path')
+    parser.add_argument('--rows', default='100k', help='number of rows, e.g. 10k, 1M')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, parse_size(args.rows), args.seed)
@@ -0,0 +1,15 @@
+import importlib
+
+from utils.profiling import profiled
+
+# Sidebar title -> module with a show() function. Modules are imported when their
+# page is first selected, so a session only loads the chart libraries it draws with.
+PAGES = {
+    'Company Insights': 'pages.company',
+    'Location Insights': 'pages.location',
+}
+
+
+@profiled
+def load_page(title):
+    return importlib.import_module(PAGES[title])
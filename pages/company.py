@@ -1,7 +1,14 @@
+from urllib.parse import urlencode
+
 import streamlit as st
 import pandas as pd
 from utils.utils_company import *
+from utils.data_store import source_version
+from utils.export import company_batches, render_download
+from utils.figure_cache import altair_chart
+from utils.profiling import profiled
 
+@profiled
 def show():
     st.title("Eco Emissions Company Dashboard 🌿")
 
@@ -11,40 +18,42 @@ def show():
     Explore the emissions data through various interactive visualizations and metrics to gain insights into the environmental impact.
     """)
 
-    # Load the data
-    data = load_data('data/Processed_Unit.csv')
-    all_data = data.copy()
+    # Comparison mode: many facilities at once, drawn as small multiples
+    if st.sidebar.radio('Mode', ['Single company', 'Compare facilities']) == 'Compare facilities':
+        show_comparison()
+        return
 
     # User Input Features in the sidebar
     company_name, date_range, emission_type = user_input_features()
 
-    # Filtering data based on user input
-    data, filtered_data = filter_data(data, company_name, date_range, emission_type)
-
-    # Pivot the filtered_data DataFrame
-    pivoted_data = pivot_data(filtered_data, emission_type)
+    # Filter, pivot, sector comparison, metrics and averages in one cached pass
+    analysis = load_company_analysis(company_name, date_range, emission_type, DATA_PATH)
+    chart_key = (source_version(DATA_PATH), company_name, tuple(date_range))
+    if analysis.data.empty:
+        st.write("No data available for the selected filters.")
+        return
 
-    # Display the pivoted table
+    # Display the pivoted table, a page at a time for broad queries
     st.write(f"### {company_name}")
-    st.dataframe(pivoted_data)
-
-    # Additional Step: Filter data for companies in the same sector as the selected company
-    top_companies_df = calculate_sector_data(data, all_data, company_name, emission_type)
+    display_pivot(analysis.pivot)
 
-    # After calculating sector data
-    top_companies_df = calculate_sector_data(data, all_data, company_name, emission_type)
+    # Download the rows behind this view, streamed batch by batch
+    with st.expander('Export data'):
+        render_download(f'{company_name}-emissions', lambda: company_batches(company_name, date_range, DATA_PATH),
+                        '/export/company?' + urlencode({'name': company_name, 'start': date_range[0],
+                                                        'end': date_range[1]}))
 
     # Display Metrics
     st.write(f'### {emission_type} emissions')
-    display_metrics(data, emission_type)
+    display_metrics(analysis.metrics)
 
 
     # Add some space and a horizontal line for separation
     st.write("---")  # Adds a horizontal line for clear separation
     st.write("")  # Adds an empty line for extra spacing, adjust the number of calls to increase spacing
 
-    # Calculate and display average emissions
-    company_avg_emissions, sector_avg_emissions = calculate_average_emissions(data, all_data, company_name, emission_type, date_range)
+    # Display average emissions
+    company_avg_emissions, sector_avg_emissions = analysis.company_avg_emissions, analysis.sector_avg_emissions
     
     # Create columns for padding, left metric, right metric, and padding again
     padding_left, col1, col2, padding_right = st.columns([1, 2, 2, 1])  # Adjust the ratio as needed for better centering
@@ -65,24 +74,56 @@ def show():
     st.write("")  # Adds an empty line for extra spacing, adjust the number of calls to increase spacing
 
     # Generate and display the line chart
-    line_chart = generate_line_chart(data, emission_type)
-    st.altair_chart(line_chart, use_container_width=True)
+    line_chart = generate_line_chart(analysis.yearly, emission_type, cache_key=chart_key)
+    altair_chart(line_chart, use_container_width=True)
 
     # Generate and display the bar chart using Plotly
-    fig = generate_bar_chart(top_companies_df, emission_type, company_name)
+    fig = generate_bar_chart(analysis.top_companies, emission_type, company_name, cache_key=chart_key)
     st.plotly_chart(fig, use_container_width=True)
 
 def user_input_features():
     st.sidebar.header('User Input Features')
-    default_company_name = 'ABBVIE LTD.'
-    company_name = st.sidebar.text_input('Company Name', value=default_company_name)
-    date_range = st.sidebar.slider('Select a date range', 2010, 2022, (2010, 2022))
-    emission_type = st.sidebar.selectbox('Select emission type', ['CO2', 'CH4', 'N2O'])
+    company_name = st.sidebar.text_input('Company Name', value=DEFAULT_COMPANY)
+    # Suggestions come from the facility index, so they stay cheap as the dataset grows
+    suggestions = [name for name in load_company_suggestions(company_name, DATA_PATH) if name != company_name]
+    if suggestions:
+        company_name = st.sidebar.selectbox('Matching facilities', [company_name] + suggestions)
+    date_range = st.sidebar.slider('Select a date range', *DEFAULT_DATE_RANGE, DEFAULT_DATE_RANGE)
+    emission_type = st.sidebar.selectbox('Select emission type', EMISSION_TYPES)
     return company_name, date_range, emission_type
 
-def display_metrics(data, emission_type):
+def comparison_input_features():
+    st.sidebar.header('Facilities to Compare')
+    query = st.sidebar.text_input('Facility names containing', value=DEFAULT_COMPANY)
+    matches = load_matching_companies(query, DATA_PATH)
+    names = st.sidebar.multiselect('Facilities', matches, default=matches[:COMPARE_LIMIT],
+                                   max_selections=COMPARE_LIMIT)
+    date_range = st.sidebar.slider('Select a date range', *DEFAULT_DATE_RANGE, DEFAULT_DATE_RANGE)
+    emission_type = st.sidebar.selectbox('Select emission type', EMISSION_TYPES)
+    return query, names, date_range, emission_type
+
+def show_comparison():
+    query, names, date_range, emission_type = comparison_input_features()
+    if not names:
+        st.write("No facilities selected.")
+        return
+
+    # Series, metrics and sector ranks of every selected facility in one grouped pass
+    comparison = load_company_comparison(names, date_range, emission_type, DATA_PATH)
+    if comparison.yearly.empty:
+        st.write("No data available for the selected filters.")
+        return
+
+    st.write(f"### {len(comparison.metrics)} facilities matching '{query}'")
+    st.dataframe(comparison.metrics, hide_index=True)
+
+    chart_key = (source_version(DATA_PATH), tuple(sorted(names)), tuple(date_range))
+    fig = generate_small_multiples(comparison.yearly, emission_type, cache_key=chart_key)
+    st.plotly_chart(fig, use_container_width=True)
+
+def display_metrics(metrics):
     col1, col2, col3 = st.columns(3)
-    total_emissions, max_emissions_year, max_emissions_value, avg_annual_increase = calculate_metrics(data, emission_type)
+    total_emissions, max_emissions_year, max_emissions_value, avg_annual_increase = metrics
     with col1:
         st.metric(label="Total Emissions (Metric Tons)", value=f"{total_emissions:.2f} MT")
     with col2:
@@ -90,4 +131,15 @@ def display_metrics(data, emission_type):
     with col3:
         st.metric(label="Average Annual Increase in Emissions (Metric Tons)", value=f"{avg_annual_increase:.2f} MT")
 
-
+PIVOT_PAGE_SIZE = 100
+
+def display_pivot(pivot):
+    if len(pivot) <= PIVOT_PAGE_SIZE:
+        st.dataframe(pivot.frame())
+        return
+    n_pages = (len(pivot) + PIVOT_PAGE_SIZE - 1) // PIVOT_PAGE_SIZE
+    page = st.number_input(f'Page (of {n_pages})', min_value=1, max_value=n_pages, value=1)
+    start = (page - 1) * PIVOT_PAGE_SIZE
+    stop = min(start + PIVOT_PAGE_SIZE, len(pivot))
+    st.dataframe(pivot.frame(start, stop))
+    st.caption(f'Facilities {start + 1}-{stop} of {len(pivot)}')
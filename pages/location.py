@@ -1,44 +1,51 @@
+from urllib.parse import urlencode
+
 import streamlit as st
 from utils.utils_location import *
+from utils.chart_tasks import build_charts, task
+from utils.data_store import source_version
+from utils.export import location_batches, render_download
+from utils.maps import plot_facility_map
+from utils.profiling import profiled
 
 # show function
+@profiled
 def show():
     st.title("Location-Based Emissions Analysis")
 
-    # Load the data
-    data = load_data('data/Processed_Unit.csv')
-
-    # Extract unique states and cities for the dropdown
-    states = data['State'].unique()
-    cities = data['City'].unique()
-
-    # Sort the unique values for better user experience
-    states = sorted(states)
-    cities = sorted(cities)
+    # States and their cities come from partition metadata, not a scan of every row
+    states, state_cities = load_location_options(DATA_PATH)
 
     st.sidebar.header("Filter Options")
     selected_state = st.sidebar.selectbox("State", states)
 
-    # Filter data for selected state to get cities
-    state_data = data[data['State'] == selected_state]
-    cities = sorted(state_data['City'].unique())
-
     # Add an "All Cities" option to the cities list
-    cities = ["All Cities"] + list(cities)
+    cities = ["All Cities"] + list(state_cities[selected_state])
     selected_city = st.sidebar.selectbox("City", cities)
 
     if selected_city == "All Cities":
         # Filter data by state only
-        filtered_data = state_data
+        filtered_data = load_location_data(selected_state, file_path=DATA_PATH)
     else:
         # Filter data by both state and city
-        filtered_data = state_data[state_data['City'] == selected_city]
+        filtered_data = load_location_data(selected_state, selected_city, DATA_PATH)
+
+    # Charts are cached per dataset version and filter selection
+    chart_key = (source_version(DATA_PATH), selected_state, selected_city)
 
     if not filtered_data.empty:
+        # Build the four independent charts concurrently, then lay them out
+        co2_by_year, distribution, by_sector, scatter = build_charts(
+            task(build_co2_emissions_by_year, filtered_data, cache_key=chart_key),
+            task(build_emissions_distribution, filtered_data, cache_key=chart_key),
+            task(build_emissions_by_sector, filtered_data, cache_key=chart_key),
+            task(build_dynamic_scatter, filtered_data, SCATTER_POINT_LIMIT, cache_key=chart_key),
+        )
+
         # Visualization 1 with caption on the right
         row1_col1, row1_col2 = st.columns([3, 1])
         with row1_col1:
-            plot_co2_emissions_by_year(filtered_data)
+            st.plotly_chart(co2_by_year, use_container_width=True)
         with row1_col2:
             st.markdown("## CO2 Emissions by Year")
             st.markdown("This chart shows the trend of CO2 emissions over the years for the selected location.")
@@ -49,7 +56,7 @@ def show():
         # Visualization 2 with caption on the right
         row2_col1, row2_col2 = st.columns([3, 1])
         with row2_col1:
-            plot_emissions_distribution(filtered_data)
+            st.plotly_chart(distribution, use_container_width=True)
         with row2_col2:
             st.markdown("## Emissions Distribution")
             st.markdown("This chart provides a distribution overview of emissions across different categories.")
@@ -60,7 +67,7 @@ def show():
         # Visualization 3 with caption on the right
         row3_col1, row3_col2 = st.columns([3, 1])
         with row3_col1:
-            plot_emissions_by_sector(filtered_data)
+            st.plotly_chart(by_sector, use_container_width=True)
         with row3_col2:
             st.markdown("## Emissions by Sector")
             st.markdown("This visualization represents emissions divided by different sectors.")
@@ -71,10 +78,28 @@ def show():
         # Visualization 4 with caption on the right
         row4_col1, row4_col2 = st.columns([3, 1])
         with row4_col1:
-            plot_dynamic_scatter(filtered_data)
+            st.plotly_chart(scatter, use_container_width=False)  # Fixed size set in the figure layout
         with row4_col2:
             st.markdown("## Dynamic Scatter Plot")
             st.markdown("This scatter plot dynamically represents various emissions metrics.")
 
+        # Border after row 4
+        st.markdown("<hr style='margin-top: 1rem; margin-bottom: 1rem; border-top: 1px solid #ccc;'>", unsafe_allow_html=True)
+
+        # Facility map from clusters precomputed once per dataset version
+        row5_col1, row5_col2 = st.columns([3, 1])
+        with row5_col1:
+            plot_facility_map(selected_state, DATA_PATH)
+        with row5_col2:
+            st.markdown("## Facility Map")
+            st.markdown("Facilities grouped by state, city or map grid cell, sized by their CO2 equivalent emissions.")
+
+        # Download the rows behind these charts, streamed batch by batch
+        city = None if selected_city == "All Cities" else selected_city
+        with st.expander("Export data"):
+            render_download(f'{selected_state}-{city or "all"}-emissions',
+                            lambda: location_batches(selected_state, city, DATA_PATH),
+                            '/export/location?' + urlencode({'state': selected_state, 'city': city or ''}))
+
     else:
         st.write("No data available for the selected filters.")
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+SECTORS = ['Power Plants', 'Chemicals', 'Minerals']
+STATES = ['TX', 'CA', 'OH']
+
+
+# Rows shaped like Processed_Unit.csv: a few facilities per sector over
+# 2010-2015, one facility that never reports a sector and one whose rows are
+# only sometimes missing it
+def emissions_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    facilities = [(f'FAC{i} ENERGY LLC', SECTORS[i % 3], STATES[i % 3]) for i in range(9)]
+    facilities += [('ORPHAN ENERGY LLC', None, 'TX'), ('MIXED ENERGY LLC', 'Chemicals', 'CA')]
+    for name, sector, state in facilities:
+        for year in range(2010, 2016):
+            for _ in range(2):
+                row_sector = None if name.startswith('MIXED') and rng.random() < 0.4 else sector
+                co2, ch4, n2o = rng.uniform(100, 1000), rng.uniform(1, 10), rng.uniform(1, 10)
+                rows.append((name, f'City{state}', state, row_sector, year, co2, ch4, n2o, co2 + 25 * ch4 + 298 * n2o))
+    return pd.DataFrame(rows, columns=['Facility.Name', 'City', 'State', 'Sector', 'Year', 'CO2_emissions',
+                                       'CH4_emissions', 'N2O_emissions', 'CO2_eq_emissions'])
+
+
+@pytest.fixture
+def emissions_csv(tmp_path):
+    path = tmp_path / 'Processed_Unit.csv'
+    emissions_frame().to_csv(path, index=False)
+    return str(path)
@@ -0,0 +1,45 @@
+import math
+
+import pandas as pd
+import pytest
+from utils.data_store import get_data
+from utils.emissions_matrix import get_emissions_matrix
+from utils.utils_company import _compute_company_analysis
+
+DATE_RANGE = (2011, 2014)
+
+
+# The shared frame goes through the emissions matrix; a plain CSV read takes the
+# row-based path
+def _analyses(path, company_name, emission_type='CO2'):
+    shared = get_data(path)
+    assert get_emissions_matrix(shared) is not None
+    return (_compute_company_analysis(shared, company_name, DATE_RANGE, emission_type),
+            _compute_company_analysis(pd.read_csv(path), company_name, DATE_RANGE, emission_type))
+
+
+def _close(a, b):
+    return math.isnan(a) and math.isnan(b) or a == pytest.approx(b, rel=1e-5)
+
+
+def test_company_without_sector(emissions_csv):
+    for analysis in _analyses(emissions_csv, 'ORPHAN'):
+        assert analysis.top_companies.empty
+        assert math.isnan(analysis.sector_avg_emissions)
+        assert analysis.company_avg_emissions > 0
+
+
+@pytest.mark.parametrize('company_name', ['ENERGY', 'MIXED', 'FAC1 ', 'ORPHAN'])
+@pytest.mark.parametrize('emission_type', ['CO2', 'CH4'])
+def test_matrix_matches_rows_with_missing_sectors(emissions_csv, company_name, emission_type):
+    matrix, rows = _analyses(emissions_csv, company_name, emission_type)
+    assert _close(matrix.company_avg_emissions, rows.company_avg_emissions)
+    assert _close(matrix.sector_avg_emissions, rows.sector_avg_emissions)
+    emission_col = f'{emission_type}_emissions'
+    assert list(matrix.top_companies['Facility.Name'].astype(str)) == list(rows.top_companies['Facility.Name'])
+    assert matrix.top_companies[emission_col].to_numpy() == pytest.approx(rows.top_companies[emission_col].to_numpy(),
+                                                                          rel=1e-5)
+    assert len(matrix.pivot) == len(rows.pivot)
+    pivot, rows_pivot = matrix.pivot.frame(), rows.pivot.frame()
+    assert [tuple(map(str, key)) for key in pivot.index] == [tuple(map(str, key)) for key in rows_pivot.index]
+    assert pivot.to_numpy() == pytest.approx(rows_pivot.to_numpy(), rel=1e-5, nan_ok=True)
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+from utils import columnar_store
+from utils.ingest import ingest, refresh
+
+from tests.conftest import emissions_frame
+
+
+def _write(frame, path):
+    frame.to_csv(path, index=False)
+    return str(path)
+
+
+# Part files on disk, to check nothing is left behind by a failed run
+def _parts(store):
+    return sorted(os.path.relpath(os.path.join(root, file), store)
+                  for root, _, files in os.walk(store) for file in files if file.startswith('part-'))
+
+
+def _published(store):
+    return sorted(file for entry in columnar_store.read_manifest(store)['years'].values() for file in entry['files'])
+
+
+def test_refresh_removes_years_of_emptied_source(tmp_path):
+    frame = emissions_frame()
+    early = _write(frame[frame['Year'] < 2013], tmp_path / 'early.csv')
+    late = _write(frame[frame['Year'] >= 2013], tmp_path / 'late.csv')
+    store = str(tmp_path / 'store')
+    ingest([early, late], store)
+
+    _write(frame.iloc[:0], late)
+    manifest = refresh([early, late], store)
+
+    assert sorted(map(int, manifest['years'])) == [2010, 2011, 2012]
+    assert manifest['sources'][os.path.abspath(late)]['years'] == []
+    rows = columnar_store.read(store)
+    assert len(rows) == (frame['Year'] < 2013).sum()
+    assert refresh([early, late], store) is None
+
+
+def test_refresh_failure_leaves_store_unchanged(tmp_path):
+    frame = emissions_frame()
+    source = _write(frame, tmp_path / 'units.csv')
+    store = str(tmp_path / 'store')
+    ingest([source], store)
+    before = columnar_store.read_manifest(store)
+
+    _write(frame.assign(Year=frame['Year'] + 10), source)
+    bad = _write(frame.drop(columns='CO2_emissions'), tmp_path / 'bad.csv')
+    with pytest.raises(ValueError, match='missing columns'):
+        refresh([source, bad], store)
+
+    assert columnar_store.read_manifest(store) == before
+    assert _parts(store) == _published(store)
+
+
+def test_ingest_failure_removes_written_parts(tmp_path):
+    frame = emissions_frame()
+    good = _write(frame, tmp_path / 'units.csv')
+    bad = _write(frame.drop(columns='Sector'), tmp_path / 'bad.csv')
+    store = str(tmp_path / 'store')
+    with pytest.raises(ValueError, match='missing columns'):
+        ingest([good, bad], store)
+
+    assert not columnar_store.is_store(store)
+    assert _parts(store) == []
@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+import pytest
+import tornado.httpclient
+import tornado.httpserver
+import tornado.testing
+from utils.query_service import make_app
+
+INVALID = ['/rollup?name=planet', '/rollup?name=sector&limit=x', '/rollup?name=sector&limit=0',
+           '/rollup?name=sector&limit=-3', '/suggest?q=ENERGY&limit=0', '/suggest?q=ENERGY&limit=-3',
+           '/company', '/company?name=ENERGY&gas=SO2', '/company?name=ENERGY&start=2010x', '/location']
+
+
+# Serve the query API over the CSV at path and fetch each (url, headers) in turn
+def _fetch_all(path, requests):
+    async def run():
+        sock, port = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(make_app(path))
+        server.add_sockets([sock])
+        client = tornado.httpclient.AsyncHTTPClient()
+        try:
+            return [await client.fetch(f'http://127.0.0.1:{port}{url}', headers=headers, raise_error=False)
+                    for url, headers in requests]
+        finally:
+            server.stop()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('url', INVALID)
+def test_invalid_parameters(emissions_csv, url):
+    # Rejected before the ETag is consulted
+    plain, conditional = _fetch_all(emissions_csv, [(url, None), (url, {'If-None-Match': '*'})])
+    assert plain.code == 400
+    assert conditional.code == 400
+
+
+def test_limit(emissions_csv):
+    response, = _fetch_all(emissions_csv, [('/rollup?name=sector&limit=1', None)])
+    assert response.code == 200
+    assert len(json.loads(response.body)) == 1
@@ -0,0 +1,130 @@
+import os
+import threading
+
+import pandas as pd
+from utils import columnar_store
+from utils.data_store import DATA_PATH, EMISSION_COLUMNS, artifact_path, get_data, scan, source_version
+
+# Summary tables used by the Home page, keyed by name
+ROLLUPS = {
+    'sector': ['Sector'],
+    'year': ['Year'],
+    'state': ['State'],
+    'facility': ['Facility.Name', 'City', 'State'],
+}
+KEY_COLUMNS = ['Facility.Name', 'City', 'State', 'Sector', 'Year']
+# Bumped when the rollups change shape or meaning, so stale files on disk get rebuilt
+AGGREGATES_FORMAT = 2
+
+_cache = {}
+_lock = threading.Lock()
+
+
+# Facility-year totals, the one full-table groupby every rollup is derived from.
+# Rows missing a key are kept (a facility without a sector still counts towards
+# its state and year), and each rollup only drops rows missing its own keys.
+def facility_year_cube(data):
+    emission_cols = [col for col in EMISSION_COLUMNS if col in data.columns]
+    cube = data.groupby(KEY_COLUMNS, observed=True, dropna=False)[emission_cols].sum()
+    cube = cube.reset_index()
+    for col in ['Facility.Name', 'City', 'State', 'Sector']:
+        cube[col] = cube[col].astype(object)
+    return cube
+
+
+def rollups_from_cube(cube):
+    emission_cols = [col for col in EMISSION_COLUMNS if col in cube.columns]
+    aggregates = {}
+    for name, keys in ROLLUPS.items():
+        rollup = cube.groupby(keys)[emission_cols].sum().reset_index()
+        if name != 'year':
+            rollup = rollup.sort_values(by='CO2_eq_emissions', ascending=False, ignore_index=True)
+        aggregates[name] = rollup
+    return aggregates
+
+
+# Compute every rollup from one facility-year groupby over the full table
+def build_aggregates(data):
+    return rollups_from_cube(facility_year_cube(data))
+
+
+# Same rollups for a columnar store. The facility-year cube is kept per year
+# partition under <store>/_aggregates/cube, tagged with the year's version, so
+# after a refresh only the rewritten years are scanned again.
+def build_store_aggregates(file_path):
+    directory = os.path.join(_aggregates_dir(file_path), 'cube')
+    os.makedirs(directory, exist_ok=True)
+    current = {f'{year}-{version}-{AGGREGATES_FORMAT}.parquet': year for year, version in columnar_store.year_versions(file_path).items()}
+    cubes = []
+    for name, year in sorted(current.items(), key=lambda item: item[1]):
+        cube_path = os.path.join(directory, name)
+        if os.path.exists(cube_path):
+            cubes.append(pd.read_parquet(cube_path))
+            continue
+        cube = facility_year_cube(scan(file_path, years=(year, year)))
+        cube.to_parquet(cube_path + '.tmp', index=False)
+        os.replace(cube_path + '.tmp', cube_path)
+        cubes.append(cube)
+    for name in os.listdir(directory):
+        if name not in current:
+            os.remove(os.path.join(directory, name))
+    return rollups_from_cube(pd.concat(cubes, ignore_index=True))
+
+
+def _aggregates_dir(file_path):
+    if columnar_store.is_store(file_path):
+        return os.path.join(file_path, '_aggregates')
+    return artifact_path(file_path, '_aggregates')
+
+
+def _read_aggregates(directory, version):
+    try:
+        with open(os.path.join(directory, 'VERSION')) as f:
+            if f.read().strip() != version:
+                return None
+        return {name: pd.read_parquet(os.path.join(directory, f'{name}.parquet')) for name in ROLLUPS}
+    except OSError:
+        return None
+
+
+def _write_aggregates(directory, version, aggregates):
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for name, rollup in aggregates.items():
+            rollup.to_parquet(os.path.join(directory, f'{name}.parquet'), index=False)
+        # Written last so a partially written directory is never picked up
+        with open(os.path.join(directory, 'VERSION'), 'w') as f:
+            f.write(version)
+    except OSError:
+        pass
+
+
+# Rollups for file_path, read from disk when they are current so the full
+# table only gets loaded when they have to be rebuilt
+def get_aggregates(file_path=DATA_PATH):
+    key = os.path.abspath(file_path)
+    version = f'{source_version(file_path)}-{AGGREGATES_FORMAT}'
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        directory = _aggregates_dir(file_path)
+        aggregates = _read_aggregates(directory, version)
+        if aggregates is None:
+            if columnar_store.is_store(file_path):
+                aggregates = build_store_aggregates(file_path)
+            else:
+                aggregates = build_aggregates(get_data(file_path))
+            _write_aggregates(directory, version, aggregates)
+        _cache[key] = (version, aggregates)
+        return aggregates
+
+
+# Offline build step: python -m utils.aggregates [path]
+if __name__ == '__main__':
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DATA_PATH
+    for name, rollup in get_aggregates(path).items():
+        print(f'{name}: {len(rollup)} rows')
@@ -0,0 +1,33 @@
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import profiling
+
+# Threads shared by every session for building figures; 1 builds them inline
+CHART_WORKERS = int(os.environ.get('EMISSIONS_CHART_WORKERS', min(4, os.cpu_count() or 1)))
+
+_executor = ThreadPoolExecutor(max_workers=CHART_WORKERS, thread_name_prefix='emissions-chart') \
+    if CHART_WORKERS > 1 else None
+
+
+def _run_in_rerun(rerun, build):
+    with profiling.attached(rerun):
+        return build()
+
+
+# Run independent chart builds concurrently and return their figures in order.
+# Each build is a zero-argument callable (e.g. functools.partial over a
+# build_* function) that must not call Streamlit; rendering stays on the
+# script thread so elements land in their layout slots.
+def build_charts(*builds):
+    if _executor is None or len(builds) < 2:
+        return [build() for build in builds]
+    rerun = profiling.current_rerun()
+    futures = [_executor.submit(_run_in_rerun, rerun, build) for build in builds]
+    return [future.result() for future in futures]
+
+
+# Shorthand for one build in a build_charts call
+def task(build, *args, **kwargs):
+    return functools.partial(build, *args, **kwargs)
@@ -0,0 +1,387 @@
+import hashlib
+import importlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from utils import columnar_store, text_index
+from utils.aggregates import get_aggregates
+from utils.data_store import DATA_PATH, artifact_path, scan, source_derived, source_version
+from utils.ingest import US_STATE_CODES
+from utils.profiling import profiled
+from utils.utils_company import DEFAULT_DATE_RANGE, load_company_analysis
+from utils.utils_location import load_location_data
+
+# Markdown or text files of policy documents searched alongside the dataset
+POLICY_DIR = os.environ.get('EMISSIONS_POLICY_DIR', 'data/policy')
+# Answer generator: 'stub' or 'package.module:factory' returning an object with
+# generate(question, passages)
+CHAT_BACKEND = os.environ.get('EMISSIONS_CHAT_BACKEND', 'stub')
+ANSWER_CACHE_SIZE = int(os.environ.get('EMISSIONS_CHAT_CACHE_SIZE', 256))
+# Cosine similarity above which a question reuses a cached answer
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('EMISSIONS_CHAT_CACHE_THRESHOLD', 0.9))
+RETRIEVAL_K = 5
+
+GASES = {
+    'CO2_eq_emissions': ('co2e', 'co2 eq', 'co2-eq', 'equivalent', 'ghg', 'greenhouse'),
+    'CH4_emissions': ('ch4', 'methane'),
+    'N2O_emissions': ('n2o', 'nitrous'),
+    'CO2_emissions': ('co2', 'carbon dioxide'),
+}
+# State names by length, so 'west virginia' is matched before 'virginia'
+STATE_NAMES = {name.lower(): code for name, code in sorted(US_STATE_CODES.items(), key=lambda item: -len(item[0]))}
+STATE_CODES = set(US_STATE_CODES.values())
+# Codes that are also ordinary words, only taken as states where the text
+# clearly names a place ("in OR", ", OK")
+AMBIGUOUS_CODES = {'AS', 'CO', 'HI', 'ID', 'IN', 'LA', 'MA', 'ME', 'OK', 'OR', 'PA'}
+# A question is about the numbers rather than about policy when it asks for a
+# quantity or a ranking, or names emissions together with a year or a facility
+_QUANTITY = re.compile(r'\b(how much|how many|total|amount|emit|emitted|tons?)\b')
+_EMISSIONS = re.compile(r'\b(emissions?|co2e?|ch4|n2o|methane|nitrous|ghg|greenhouse|carbon)\b')
+_TOP = re.compile(r'\b(?:top|largest|biggest|highest|most)\s+(\d+\s+)?(?:\w+\s+)?'
+                  r'(sectors?|states?|facilit(?:y|ies)|compan(?:y|ies)|emitters?|plants?)\b')
+_YEAR = re.compile(r'\b(19[89]\d|20\d\d)\b')
+_QUOTED = re.compile(r'"([^"]+)"|“([^”]+)”')
+_STATE_CODE = re.compile(r'\b[A-Z]{2}\b')
+_PLACE_CUE = re.compile(r'(?:\b(?i:in|for|from|across|within|of|and|or|vs)\s+|,\s*)$')
+
+FACILITY_PREFIX = 'Facility: '
+
+
+# What a question asks about, as far as the structured lookups are concerned
+@dataclass(frozen=True)
+class Question:
+    text: str
+    gas: str
+    date_range: tuple
+    states: tuple
+    facility: str
+    top: tuple
+    numeric: bool
+
+
+def parse_question(text):
+    lowered = text.lower()
+    gas = next((col for col, words in GASES.items() if any(re.search(rf'\b{re.escape(word)}\b', lowered)
+                                                              for word in words)), 'CO2_eq_emissions')
+    years = sorted(int(year) for year in _YEAR.findall(lowered))
+    states = {match.group() for match in _STATE_CODE.finditer(text) if match.group() in STATE_CODES and
+              (match.group() not in AMBIGUOUS_CODES or _PLACE_CUE.search(text, 0, match.start()))}
+    remaining = lowered
+    for name, code in STATE_NAMES.items():
+        remaining, found = re.subn(rf'\b{name}\b', ' ', remaining)
+        if found:
+            states.add(code)
+    quoted = _QUOTED.search(text)
+    top = _TOP.search(lowered)
+    return Question(
+        text=text,
+        gas=gas,
+        date_range=(years[0], years[-1]) if years else None,
+        states=tuple(sorted(states)),
+        facility=(quoted.group(1) or quoted.group(2)).strip() if quoted else None,
+        top=(int(top.group(1) or 5), top.group(2)) if top else None,
+        numeric=bool(top or _QUANTITY.search(lowered) or _EMISSIONS.search(lowered) and (years or quoted)),
+    )
+
+
+def _gas_label(gas):
+    return gas.replace('_emissions', '').replace('_eq', 'e')
+
+
+def _tons(value):
+    return f'{value:,.2f} MT'
+
+
+def _range_label(date_range):
+    if date_range is None:
+        return 'across all reported years'
+    return f'in {date_range[0]}' if date_range[0] == date_range[1] else f'from {date_range[0]} to {date_range[1]}'
+
+
+# An answer and where it came from: a structured lookup, retrieval plus the
+# backend, or the answer cache
+@dataclass(frozen=True)
+class ChatAnswer:
+    text: str
+    sources: tuple
+    origin: str
+
+
+def _top_answer(question, file_path):
+    limit, target = question.top
+    gas, label = question.gas, _gas_label(question.gas)
+    if target.startswith('sector'):
+        keys = ['Sector']
+    elif target.startswith('state'):
+        keys = ['State']
+    else:
+        keys = ['Facility.Name', 'City', 'State']
+    rollup = None
+    if question.date_range is None:
+        rollup = get_aggregates(file_path)[{'Sector': 'sector', 'State': 'state'}.get(keys[0], 'facility')]
+        # The sector rollup has no State column, so state questions go to the dataset
+        if question.states:
+            rollup = rollup[rollup['State'].isin(question.states)] if 'State' in rollup.columns else None
+        source = 'aggregates'
+    if rollup is None:
+        data = scan(file_path, years=question.date_range, states=list(question.states) or None)
+        rollup = data.groupby(keys, observed=True)[gas].sum().reset_index()
+        source = 'dataset'
+    rows = rollup.nlargest(limit, gas)
+    where = f' in {", ".join(question.states)}' if question.states and keys[0] != 'State' else ''
+    lines = [f'{i}. {" — ".join(str(row[key]) for key in keys)}: {_tons(row[gas])}'
+             for i, (_, row) in enumerate(rows.iterrows(), 1)]
+    header = f'Top {len(rows)} by {label} emissions{where} {_range_label(question.date_range)}:'
+    return ChatAnswer('\n'.join([header] + lines), (f'{source}: top {keys[0]}',), 'lookup')
+
+
+def _state_answer(question, file_path):
+    gas, label = question.gas, _gas_label(question.gas)
+    lines, sources = [], []
+    for state in question.states:
+        if question.date_range is None:
+            rollup = get_aggregates(file_path)['state']
+            total = rollup.loc[rollup['State'] == state, gas].sum()
+            sources.append(f'aggregates: state {state}')
+        else:
+            data = load_location_data(state, None, file_path)
+            years = data['Year']
+            total = data.loc[(years >= question.date_range[0]) & (years <= question.date_range[1]), gas].sum()
+            sources.append(f'location data: {state}')
+        lines.append(f'{state} reported {_tons(total)} of {label} {_range_label(question.date_range)}.')
+    return ChatAnswer('\n'.join(lines), tuple(sources), 'lookup')
+
+
+def _year_answer(question, file_path):
+    gas, label = question.gas, _gas_label(question.gas)
+    rollup = get_aggregates(file_path)['year']
+    in_range = rollup[(rollup['Year'] >= question.date_range[0]) & (rollup['Year'] <= question.date_range[1])]
+    return ChatAnswer(f'Reporting facilities emitted {_tons(in_range[gas].sum())} of {label} '
+                      f'{_range_label(question.date_range)}.', ('aggregates: year',), 'lookup')
+
+
+def _facility_answer(question, facility, file_path):
+    # The company analysis works per gas, so CO2e questions are answered in CO2
+    emission_type = _gas_label(question.gas) if question.gas != 'CO2_eq_emissions' else 'CO2'
+    date_range = question.date_range or DEFAULT_DATE_RANGE
+    analysis = load_company_analysis(facility, date_range, emission_type, file_path)
+    if analysis.data.empty:
+        return ChatAnswer(f'No facility matching "{facility}" reported {emission_type} emissions '
+                          f'{_range_label(date_range)}.', (), 'lookup')
+    total, max_year, max_value, _ = analysis.metrics
+    return ChatAnswer(f'Facilities matching "{facility}" reported {_tons(total)} of {emission_type} '
+                      f'{_range_label(date_range)}, peaking in {max_year} with {_tons(max_value)} in a single report.',
+                      (f'company analysis: {facility}',), 'lookup')
+
+
+# Answer numeric questions straight from the aggregates and page computations;
+# None when the question is not one of the supported shapes
+@profiled
+def lookup(question, file_path=DATA_PATH, hits=()):
+    if not question.numeric:
+        return None
+    facility = question.facility
+    if facility is None:
+        # A retrieved facility whose full name appears in the question
+        facility = next((title[len(FACILITY_PREFIX):] for _, _, title, _ in hits if title.startswith(FACILITY_PREFIX)
+                         and title[len(FACILITY_PREFIX):].lower() in question.text.lower()), None)
+    if question.top:
+        return _top_answer(question, file_path)
+    if facility:
+        return _facility_answer(question, facility, file_path)
+    if question.states:
+        return _state_answer(question, file_path)
+    if question.date_range:
+        return _year_answer(question, file_path)
+    return None
+
+
+def _policy_files(directory=POLICY_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(('.md', '.txt')))
+
+
+# Passages of the policy documents: one per paragraph, titled by the file and
+# the heading above it
+def policy_passages(directory=POLICY_DIR):
+    passages = []
+    for path in _policy_files(directory):
+        title = os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+        heading = title
+        with open(path, encoding='utf-8') as f:
+            for block in re.split(r'\n\s*\n', f.read()):
+                block = block.strip()
+                if block.startswith('#'):
+                    heading, _, block = block.partition('\n')
+                    heading = f'{title}: {heading.lstrip("#").strip()}'
+                    block = block.strip()
+                if block:
+                    passages.append((f'Policy: {heading}', block))
+    return passages
+
+
+# One document per state, sector, year and facility of the Home page rollups
+def dataset_documents(file_path=DATA_PATH):
+    aggregates = get_aggregates(file_path)
+    gases = [gas for gas in GASES if gas in aggregates['state'].columns]
+
+    def totals(row):
+        return ', '.join(f'{_gas_label(gas)} {_tons(row[gas])}' for gas in gases)
+
+    documents = []
+    for _, row in aggregates['state'].iterrows():
+        documents.append((f'State: {row["State"]}', f'Total reported emissions in {row["State"]}: {totals(row)}.'))
+    for _, row in aggregates['sector'].iterrows():
+        documents.append((f'Sector: {row["Sector"]}', f'Total reported emissions of the {row["Sector"]} sector: '
+                                                      f'{totals(row)}.'))
+    for _, row in aggregates['year'].iterrows():
+        documents.append((f'Year: {row["Year"]}', f'Total reported emissions in {row["Year"]}: {totals(row)}.'))
+    columns = ['Facility.Name', 'City', 'State'] + gases
+    for name, city, state, *values in aggregates['facility'][columns].itertuples(index=False, name=None):
+        documents.append((f'{FACILITY_PREFIX}{name}', f'{name} is a facility in {city}, {state}. '
+                                                      f'Total reported emissions: {totals(dict(zip(gases, values)))}.'))
+    return documents
+
+
+def _corpus_version(file_path):
+    digest = hashlib.sha1(source_version(file_path).encode())
+    for path in _policy_files():
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def _index_dir(file_path):
+    if columnar_store.is_store(file_path):
+        return os.path.join(file_path, '_chat_index')
+    return artifact_path(file_path, '_chat_index')
+
+
+# The retrieval index of a source and the policy documents, built on disk the
+# first time any process needs it and memory-mapped by every process after that
+@profiled
+def get_chat_index(file_path=DATA_PATH):
+    version = _corpus_version(file_path)
+
+    def build(path):
+        directory = _index_dir(path)
+        if text_index.index_version(directory) != version:
+            text_index.build_index(dataset_documents(path) + policy_passages(), directory, version)
+        return text_index.TextIndex(directory)
+
+    return source_derived(file_path, 'chat_index', build, version)
+
+
+# Extractive answers from the retrieved passages: the sentences sharing the
+# most terms with the question. Stands in for a model in tests and offline use.
+class StubBackend:
+    def generate(self, question, passages):
+        terms = set(text_index.tokenize(question))
+        sentences = [(len(terms & set(text_index.tokenize(sentence))), -rank, sentence)
+                     for rank, (_, text) in enumerate(passages)
+                     for sentence in re.split(r'(?<=[.!?])\s+(?=[A-Z])', text) if sentence]
+        best = [sentence for overlap, _, sentence in sorted(sentences, reverse=True)[:3] if overlap]
+        return ' '.join(best) if best else "I couldn't find anything about that in the emissions data or policy documents."
+
+
+def load_backend(spec=CHAT_BACKEND):
+    if spec == 'stub':
+        return StubBackend()
+    module, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module), attr)()
+
+
+# Recent answers keyed by an embedding of the question. A question reuses an
+# answer when it is close enough to a cached one and names the same states,
+# years, gas and facility, so rephrasings hit the cache but "TX" never gets
+# the answer for "CA".
+class AnswerCache:
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(version, question):
+        numbers = tuple(re.findall(r'\d+', question.text))
+        return version, question.gas, question.date_range, question.states, question.facility, question.top, numbers
+
+    def get(self, signature, vector):
+        with self._lock:
+            candidates = [(key, entry) for key, entry in self._entries.items() if entry[0] == signature]
+            best = max(candidates, key=lambda item: float(item[1][1] @ vector), default=None)
+            if best is None or float(best[1][1] @ vector) < self.threshold:
+                return None
+            self._entries.move_to_end(best[0])
+            return best[1][2]
+
+    def put(self, signature, vector, text, answer):
+        with self._lock:
+            self._entries[(signature, text)] = (signature, vector, answer)
+            self._entries.move_to_end((signature, text))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_answer_cache = AnswerCache()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = load_backend()
+        return _backend
+
+
+# Answer a chat question: from the answer cache, else a structured lookup over
+# the aggregates, else the backend over the top retrieved passages
+@profiled
+def answer(text, file_path=DATA_PATH, backend=None, cache=_answer_cache):
+    question = parse_question(text)
+    index = get_chat_index(file_path)
+    vector = text_index.embed(text)
+    signature = AnswerCache.signature(index.version, question)
+    cached = cache.get(signature, vector)
+    if cached is not None:
+        return ChatAnswer(cached.text, cached.sources, 'cache')
+
+    hits = index.search(text, RETRIEVAL_K)
+    result = lookup(question, file_path, hits)
+    if result is None:
+        passages = [(title, passage) for _, _, title, passage in hits]
+        result = ChatAnswer((backend or get_backend()).generate(text, passages),
+                            tuple(title for title, _ in passages), 'retrieval')
+    cache.put(signature, vector, text.strip().lower(), result)
+    return result
+
+
+# Offline build step: python -m utils.chat [path] [--ask "question"]
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Build the Chat page retrieval index and optionally ask it')
+    parser.add_argument('path', nargs='?', default=DATA_PATH)
+    parser.add_argument('--ask', help='question to answer once the index is built')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = get_chat_index(args.path)
+    print(f'{len(index)} documents indexed in {index.directory} ({time.perf_counter() - start:.2f}s)')
+    if args.ask:
+        reply = answer(args.ask, args.path)
+        print(f'[{reply.origin}] {reply.text}')
+        for source in reply.sources:
+            print(f'  - {source}')
@@ -0,0 +1,259 @@
+import json
+import os
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# On-disk layout of a columnar store:
+#   <store>/Year=2010/part-*.parquet         one directory per reporting year
+#   <store>/Year=2010/_facilities-*.parquet  facilities reporting in that year
+#   <store>/_facilities.parquet              distinct facility/sector/state/city rows
+#   <store>/_manifest.json                   versions, row counts, the live files
+#                                            of each year and the ingested sources
+# Readers only open the files listed in the manifest, so a year can be replaced
+# by writing new files and then swapping the manifest.
+MANIFEST = '_manifest.json'
+FACILITIES = '_facilities.parquet'
+FACILITY_COLUMNS = ['Facility.Name', 'Sector', 'State', 'City']
+STRING_COLUMNS = ['Facility.Name', 'City', 'State', 'Sector']
+NUMERIC_COLUMNS = ['CO2_emissions', 'CH4_emissions', 'N2O_emissions', 'CO2_eq_emissions']
+OPTIONAL_NUMERIC_COLUMNS = ['Latitude', 'Longitude']
+PARTITIONING = ds.partitioning(pa.schema([('Year', pa.int16())]), flavor='hive')
+# Small row groups over state-sorted chunks keep State min/max statistics narrow,
+# so state filters skip most row groups
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST))
+
+
+# mtime and size of a source file, enough to notice it was replaced
+def source_fingerprint(path):
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def new_version():
+    return f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return _upgrade_manifest(path, json.load(f))
+
+
+# Fill in what manifests written before incremental refresh lack: the live files
+# of each year (then every part file in the year's directory) and per-source
+# fingerprints and years. Unknown fingerprints make the next refresh rebuild
+# every year from those sources, after which the manifest is complete.
+def _upgrade_manifest(path, manifest):
+    for year, entry in manifest['years'].items():
+        if 'files' not in entry:
+            directory = f'Year={year}'
+            entry['files'] = sorted(f'{directory}/{name}' for name in os.listdir(os.path.join(path, directory))
+                                    if name.startswith('part-') and name.endswith('.parquet'))
+            entry['facilities'] = []
+    if isinstance(manifest['sources'], list):
+        years = sorted(int(year) for year in manifest['years'])
+        manifest['sources'] = {source: {'fingerprint': None, 'years': years} for source in manifest['sources']}
+    return manifest
+
+
+def write_manifest(path, manifest):
+    tmp_path = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def store_version(path):
+    return read_manifest(path)['version']
+
+
+def store_years(path):
+    return sorted(int(year) for year in read_manifest(path)['years'])
+
+
+# Version of the facility table; unlike the store version it only changes when
+# a refresh adds or removes facilities
+def facilities_version(path):
+    manifest = read_manifest(path)
+    return manifest.get('facilities_version', manifest['version'])
+
+
+# Version of each year partition, bumped only when that year is rewritten
+def year_versions(path):
+    return {int(year): entry['version'] for year, entry in read_manifest(path)['years'].items()}
+
+
+def _filter_expression(years=None, states=None, sectors=None, facilities=None):
+    conditions = []
+    if years is not None:
+        conditions += [ds.field('Year') >= years[0], ds.field('Year') <= years[1]]
+    if states is not None:
+        conditions.append(ds.field('State').isin(pa.array(list(states), type=pa.string())))
+    if sectors is not None:
+        conditions.append(ds.field('Sector').isin(pa.array(list(sectors), type=pa.string())))
+    if facilities is not None:
+        conditions.append(ds.field('Facility.Name').isin(pa.array(list(facilities), type=pa.string())))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+# Rows of the store matching the predicates; the year range prunes partition
+# directories and state/sector filters are pushed down to row-group statistics
+def _dataset(path, years=None):
+    manifest = read_manifest(path)
+    files = [os.path.join(path, file) for year, entry in sorted(manifest['years'].items())
+             if years is None or years[0] <= int(year) <= years[1]
+             for file in entry['files']]
+    return ds.dataset(files, format='parquet', partitioning=PARTITIONING, partition_base_dir=path)
+
+
+# Column names of the store's rows, e.g. to project optional columns only when present
+def columns(path):
+    return _dataset(path).schema.names
+
+
+def read(path, years=None, states=None, sectors=None, columns=None, facilities=None):
+    table = _dataset(path, years).to_table(columns=columns,
+                                           filter=_filter_expression(years, states, sectors, facilities))
+    return table.to_pandas()
+
+
+# Same rows as read(), as a sequence of frames of at most batch_rows rows so
+# callers can stream them without holding the whole result. Always yields at
+# least one (possibly empty) frame carrying the columns.
+def iter_batches(path, batch_rows, years=None, states=None, sectors=None, columns=None, facilities=None):
+    dataset = _dataset(path, years)
+    scanner = dataset.scanner(columns=columns, filter=_filter_expression(years, states, sectors, facilities),
+                              batch_size=batch_rows)
+    empty = True
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            empty = False
+            yield batch.to_pandas()
+    if empty:
+        yield scanner.projected_schema.empty_table().to_pandas()
+
+
+def read_facilities(path):
+    return pd.read_parquet(os.path.join(path, FACILITIES))
+
+
+def _remove_files(path, files):
+    for file in files:
+        try:
+            os.remove(os.path.join(path, file))
+        except FileNotFoundError:
+            pass
+
+
+# Appends normalized chunks to a store, one Parquet file per year per writer
+class StoreWriter:
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.rows = {}
+        self._run = uuid.uuid4().hex[:8]
+        self._writers = {}
+        self._facilities = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _year_file(self, year, prefix):
+        return f'Year={year}/{prefix}-{self._run}.parquet'
+
+    def _writer(self, year):
+        if year not in self._writers:
+            os.makedirs(os.path.join(self.path, f'Year={year}'), exist_ok=True)
+            file_path = os.path.join(self.path, self._year_file(year, 'part'))
+            self._writers[year] = pq.ParquetWriter(file_path, self.schema)
+        return self._writers[year]
+
+    def write(self, chunk):
+        chunk = chunk.sort_values(['Year', 'State', 'Sector'], kind='stable')
+        for year, rows in chunk.groupby('Year', sort=False):
+            year = int(year)
+            table = pa.Table.from_pandas(rows.drop(columns='Year'), schema=self.schema, preserve_index=False)
+            self._writer(year).write_table(table, row_group_size=ROW_GROUP_SIZE)
+            self.rows[year] = self.rows.get(year, 0) + len(rows)
+            facilities = self._facilities.setdefault(year, [])
+            facilities.append(rows[FACILITY_COLUMNS].drop_duplicates())
+            if len(facilities) > 32:
+                self._facilities[year] = [pd.concat(facilities, ignore_index=True).drop_duplicates()]
+
+    def _write_year_facilities(self, year):
+        facilities = pd.concat(self._facilities[year], ignore_index=True).drop_duplicates()
+        file = self._year_file(year, '_facilities')
+        facilities.to_parquet(os.path.join(self.path, file), index=False)
+        return file
+
+    # Facility file of a year kept from an upgraded store, which only had the
+    # store-wide facility table
+    def _backfill_year_facilities(self, year, files):
+        dataset = ds.dataset([os.path.join(self.path, file) for file in files], format='parquet')
+        facilities = dataset.to_table(columns=FACILITY_COLUMNS)
+        file = self._year_file(year, '_facilities-upgraded')
+        facilities.to_pandas().drop_duplicates().to_parquet(os.path.join(self.path, file), index=False)
+        return file
+
+    # Drop everything this writer wrote without touching the manifest
+    def abort(self):
+        for writer in self._writers.values():
+            writer.close()
+        _remove_files(self.path, [self._year_file(year, 'part') for year in self._writers])
+
+    # Close the year files, merge the facility table and publish a new store
+    # version. sources maps each ingested source path to its manifest entry; the
+    # existing files of replace_years are swapped for this writer's, not appended to.
+    def close(self, sources=None, replace_years=()):
+        for writer in self._writers.values():
+            writer.close()
+
+        manifest = read_manifest(self.path) if is_store(self.path) else {'years': {}, 'sources': {}}
+        # Files replaced by the previous refresh are only deleted now, so readers
+        # that loaded the old manifest could still finish their scans
+        _remove_files(self.path, manifest.get('obsolete', []))
+        obsolete = []
+        version = new_version()
+        for year, entry in manifest['years'].items():
+            if entry['files'] and not entry['facilities'] and int(year) not in replace_years:
+                entry['facilities'].append(self._backfill_year_facilities(year, entry['files']))
+        for year in sorted(set(replace_years) | set(self.rows)):
+            entry = manifest['years'].get(str(year), {'rows': 0, 'files': [], 'facilities': []})
+            if year in replace_years:
+                obsolete += entry['files'] + entry['facilities']
+                entry = {'rows': 0, 'files': [], 'facilities': []}
+            if year in self.rows:
+                entry['rows'] += self.rows[year]
+                entry['files'].append(self._year_file(year, 'part'))
+                entry['facilities'].append(self._write_year_facilities(year))
+                entry['version'] = version
+                manifest['years'][str(year)] = entry
+            else:
+                manifest['years'].pop(str(year), None)
+
+        facilities_path = os.path.join(self.path, FACILITIES)
+        previous = pd.read_parquet(facilities_path) if os.path.exists(facilities_path) else None
+        files = [os.path.join(self.path, file) for entry in manifest['years'].values() for file in entry['facilities']]
+        merged = pd.concat([pd.read_parquet(file) for file in files], ignore_index=True) if files else \
+            pd.DataFrame(columns=FACILITY_COLUMNS)
+        merged = merged.drop_duplicates().sort_values(FACILITY_COLUMNS, ignore_index=True)
+        if previous is None or not previous.equals(merged):
+            merged.to_parquet(facilities_path + '.tmp', index=False)
+            os.replace(facilities_path + '.tmp', facilities_path)
+            manifest['facilities_version'] = version
+
+        manifest['version'] = version
+        manifest['rows'] = sum(entry['rows'] for entry in manifest['years'].values())
+        manifest['sources'] = {**manifest['sources'], **(sources or {})}
+        manifest['obsolete'] = obsolete
+        write_manifest(self.path, manifest)
+        return manifest
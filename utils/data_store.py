@@ -0,0 +1,193 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from utils import columnar_store
+
+# Location of the EPA unit-level extract, overridable for deployments and benchmarks
+DATA_PATH = os.environ.get('EMISSIONS_DATA_PATH', 'data/Processed_Unit.csv')
+
+CATEGORY_COLUMNS = ['Facility.Name', 'Sector', 'City', 'State']
+EMISSION_COLUMNS = ['CO2_emissions', 'CH4_emissions', 'N2O_emissions', 'CO2_eq_emissions']
+
+# Frames handed out by the store are shared by every session in the process, so
+# any derived frame that gets modified must copy instead of writing through
+pd.set_option('mode.copy_on_write', True)
+
+_datasets = {}
+_lock = threading.Lock()
+
+
+# A loaded copy of the emissions file plus the structures derived from it
+class Dataset:
+    def __init__(self, path, frame, version):
+        self.path = path
+        self.frame = frame
+        self.version = version
+        self._derived = {}
+        self._lock = threading.RLock()
+
+    # Build a derived structure (index, aggregate, ...) once per dataset version
+    def derived(self, name, build):
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = build(self.frame)
+            return self._derived[name]
+
+    # Snapshot of the derived structures built so far, by name
+    def derived_structures(self):
+        with self._lock:
+            return dict(self._derived)
+
+
+# Largest rounding error (metric tons) accepted when storing an emission column
+# as float32: half of the 0.01 MT the pages display
+FLOAT32_TOLERANCE = float(os.environ.get('EMISSIONS_FLOAT32_TOLERANCE', 0.005))
+
+
+# float32 copy of an emission column when every value survives the round trip
+# within FLOAT32_TOLERANCE, float64 otherwise (e.g. multi-megaton CO2 totals)
+def _compact_floats(values):
+    values = pd.to_numeric(values)
+    if values.dtype != np.float64:
+        return values
+    narrowed = values.astype(np.float32)
+    with np.errstate(invalid='ignore', over='ignore'):
+        error = np.abs(narrowed.to_numpy(np.float64) - values.to_numpy())
+    if np.nanmax(error, initial=0) <= FLOAT32_TOLERANCE:
+        return narrowed
+    return values
+
+
+# Convert the raw CSV frame to the compact in-memory representation: dictionary
+# encoded (categorical) strings, int16 years and float32 emissions where precise enough
+def compact_frame(data):
+    data = data.copy(deep=False)
+    for col in CATEGORY_COLUMNS:
+        if col in data.columns and not isinstance(data[col].dtype, pd.CategoricalDtype):
+            data[col] = data[col].astype('category')
+    if 'Year' in data.columns and pd.api.types.is_integer_dtype(data['Year']) and len(data) and \
+            np.iinfo(np.int16).min <= data['Year'].min() and data['Year'].max() <= np.iinfo(np.int16).max:
+        data['Year'] = data['Year'].astype(np.int16)
+    for col in EMISSION_COLUMNS:
+        if col in data.columns:
+            data[col] = _compact_floats(data[col])
+    return data
+
+
+# Cheap fingerprint of the source used to invalidate everything derived from it:
+# the manifest version of a columnar store, or the CSV's mtime and size
+def source_version(file_path):
+    if columnar_store.is_store(file_path):
+        return columnar_store.store_version(file_path)
+    return columnar_store.source_fingerprint(file_path)
+
+
+# Path of an artifact stored next to the source file, e.g. data/Processed_Unit.parquet
+def artifact_path(file_path, suffix):
+    return os.path.splitext(file_path)[0] + suffix
+
+
+# Read the source file, going through a Parquet copy that is refreshed whenever
+# the CSV is newer than it
+def _read_columnar(file_path):
+    if columnar_store.is_store(file_path):
+        return compact_frame(columnar_store.read(file_path))
+    if file_path.endswith('.parquet'):
+        return compact_frame(pd.read_parquet(file_path))
+
+    parquet_path = artifact_path(file_path, '.parquet')
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(file_path):
+        return compact_frame(pd.read_parquet(parquet_path))
+
+    data = compact_frame(pd.read_csv(file_path))
+    try:
+        data.to_parquet(parquet_path, index=False)
+    except OSError:
+        # Read-only deployments still get the in-memory copy
+        pass
+    return data
+
+
+# Process-wide dataset for file_path, reloaded when the file changes on disk
+def get_dataset(file_path=DATA_PATH):
+    key = os.path.abspath(file_path)
+    version = source_version(file_path)
+    with _lock:
+        dataset = _datasets.get(key)
+        if dataset is None or dataset.version != version:
+            dataset = Dataset(file_path, _read_columnar(file_path), version)
+            _datasets[key] = dataset
+        return dataset
+
+
+# Shared read-only emissions frame for file_path
+def get_data(file_path=DATA_PATH):
+    return get_dataset(file_path).frame
+
+
+# The store dataset that owns this exact frame, or None for frames derived from it
+def lookup_dataset(data):
+    for dataset in list(_datasets.values()):
+        if dataset.frame is data:
+            return dataset
+    return None
+
+
+# The store dataset data was taken from: the shared frame itself or a subset of
+# it, recognised by sharing the dataset's facility categories
+def source_dataset(data):
+    dataset = lookup_dataset(data)
+    if dataset is not None or 'Facility.Name' not in data.columns:
+        return dataset
+    dtype = data['Facility.Name'].dtype
+    if not isinstance(dtype, pd.CategoricalDtype):
+        return None
+    for dataset in list(_datasets.values()):
+        if dataset.frame['Facility.Name'].dtype == dtype:
+            return dataset
+    return None
+
+
+# Forget every loaded dataset so the next access reloads from disk
+def clear():
+    with _lock:
+        _datasets.clear()
+
+
+# Rows of the source matching the predicates. Columnar stores push the filters
+# down to the Parquet scan so only matching rows are read; other sources are
+# filtered from the shared in-memory frame.
+def scan(file_path=DATA_PATH, years=None, states=None, sectors=None, columns=None):
+    if columnar_store.is_store(file_path):
+        return compact_frame(columnar_store.read(file_path, years, states, sectors, columns))
+
+    data = get_data(file_path)
+    mask = pd.Series(True, index=data.index)
+    if years is not None:
+        mask &= (data['Year'] >= years[0]) & (data['Year'] <= years[1])
+    if states is not None:
+        mask &= data['State'].isin(states)
+    if sectors is not None:
+        mask &= data['Sector'].isin(sectors)
+    data = data[mask]
+    return data[columns] if columns is not None else data
+
+
+_source_derived = {}
+_source_derived_lock = threading.RLock()
+
+
+# Build a structure derived from a source (e.g. a columnar store's facility
+# index) once per source version, without loading the full table. version
+# overrides the source version for structures that depend on less than all of it.
+def source_derived(file_path, name, build, version=None):
+    key = (os.path.abspath(file_path), name)
+    version = version or source_version(file_path)
+    with _source_derived_lock:
+        cached = _source_derived.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build(file_path))
+            _source_derived[key] = cached
+        return cached[1]
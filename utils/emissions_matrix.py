@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from utils.data_store import EMISSION_COLUMNS, lookup_dataset
+
+
+# Dense (facility, sector) x year matrices of emission sums and non-null counts,
+# one pair per gas, built once per dataset
+class EmissionsMatrix:
+    def __init__(self, data):
+        gases = [col for col in EMISSION_COLUMNS if col in data.columns]
+        grouped = data.groupby(['Facility.Name', 'Sector', 'Year'], observed=True)[gases].agg(['sum', 'count'])
+
+        self.facilities = grouped.index.droplevel('Year').unique()
+        self.years = np.sort(grouped.index.get_level_values('Year').unique().to_numpy())
+        rows = self.facilities.get_indexer(grouped.index.droplevel('Year'))
+        cols = np.searchsorted(self.years, grouped.index.get_level_values('Year').to_numpy())
+
+        shape = (len(self.facilities), len(self.years))
+        self.sums = {}
+        self.counts = {}
+        for gas in gases:
+            self.sums[gas] = np.zeros(shape)
+            self.sums[gas][rows, cols] = grouped[(gas, 'sum')].to_numpy()
+            # Rows per facility-year are few, so counts fit a small integer type
+            counts = grouped[(gas, 'count')].to_numpy()
+            self.counts[gas] = np.zeros(shape, dtype=np.min_scalar_type(counts.max(initial=0)))
+            self.counts[gas][rows, cols] = counts
+
+        # Running totals along the year axis behind a leading zero column, so the
+        # total of any row over a year range is two lookups and a subtraction
+        self.cumulative_sums = {gas: _cumulative(sums) for gas, sums in self.sums.items()}
+        self.cumulative_counts = {gas: _cumulative(counts) for gas, counts in self.counts.items()}
+
+        # The same running totals per sector, for sector averages over any range
+        sectors = pd.Categorical(self.facilities.get_level_values('Sector'), dtype=data['Sector'].dtype)
+        self.sectors = sectors.categories
+        self._sector_codes = sectors.codes
+        self._sector_order = np.argsort(sectors.codes, kind='stable')
+        self._sector_offsets = np.searchsorted(sectors.codes[self._sector_order], np.arange(len(self.sectors) + 1))
+        self.sector_cumulative_sums = {gas: _by_sector(cumulative, sectors.codes, len(self.sectors))
+                                       for gas, cumulative in self.cumulative_sums.items()}
+        self.sector_cumulative_counts = {gas: _by_sector(cumulative, sectors.codes, len(self.sectors))
+                                         for gas, cumulative in self.cumulative_counts.items()}
+
+        # Matrix rows are sorted by facility, so each facility name code owns a
+        # contiguous block of rows (one per sector it reports under)
+        names = pd.Categorical(self.facilities.get_level_values('Facility.Name'), dtype=data['Facility.Name'].dtype)
+        self._name_offsets = np.searchsorted(names.codes, np.arange(len(names.categories) + 1))
+
+    # Matrix rows of the facilities with these name codes (facility category codes)
+    def facility_rows(self, name_codes):
+        blocks = [np.arange(self._name_offsets[code], self._name_offsets[code + 1]) for code in name_codes]
+        return np.concatenate(blocks) if blocks else np.array([], dtype=np.intp)
+
+    def year_slice(self, date_range):
+        return slice(np.searchsorted(self.years, date_range[0]), np.searchsorted(self.years, date_range[1], side='right'))
+
+    # Positions of the first and past-the-last year of a range (all years when
+    # None) in the cumulative arrays
+    def _bounds(self, date_range):
+        if date_range is None:
+            return 0, len(self.years)
+        years = self.year_slice(date_range)
+        return years.start, max(years.start, years.stop)
+
+    # Emission sums and non-null counts of matrix rows (all rows by default) over a year range
+    def range_totals(self, gas, date_range=None, rows=None):
+        start, stop = self._bounds(date_range)
+        sums, counts = self.cumulative_sums[gas], self.cumulative_counts[gas]
+        if rows is not None:
+            sums, counts = sums[rows], counts[rows]
+        return sums[:, stop] - sums[:, start], counts[:, stop] - counts[:, start]
+
+    # Position of a sector in self.sectors, None for a missing sector or one
+    # no facility reports under (rows without a sector are not in the matrix)
+    def _sector_code(self, sector):
+        if pd.isna(sector) or sector not in self.sectors:
+            return None
+        return self.sectors.get_loc(sector)
+
+    # Sum and non-null count of one sector over a year range
+    def sector_range_totals(self, gas, sector, date_range=None):
+        code = self._sector_code(sector)
+        if code is None:
+            return 0.0, 0
+        start, stop = self._bounds(date_range)
+        sums, counts = self.sector_cumulative_sums[gas][code], self.sector_cumulative_counts[gas][code]
+        return sums[stop] - sums[start], counts[stop] - counts[start]
+
+    def sector_rows(self, sector):
+        code = self._sector_code(sector)
+        if code is None:
+            return np.array([], dtype=np.intp)
+        return self._sector_order[self._sector_offsets[code]:self._sector_offsets[code + 1]]
+
+    # Year-range totals of each facility of a sector, indexed by facility name
+    def sector_facility_totals(self, gas, sector, date_range=None):
+        rows = self.sector_rows(sector)
+        sums, _ = self.range_totals(gas, date_range, rows)
+        return pd.Series(sums, index=self.facilities[rows].get_level_values('Facility.Name'))
+
+    # Company table for the facilities in name_codes, equivalent to pivot_data on
+    # the filtered rows: mean per facility-year, 0 where absent, and only the
+    # facilities and years that have data
+    def pivot(self, name_codes, date_range, emission_type):
+        gas = f'{emission_type}_emissions'
+        rows = self.facility_rows(np.sort(name_codes))
+        years = self.year_slice(date_range)
+        present = self.counts[gas][rows, years] > 0
+        rows = rows[present.any(axis=1)]
+        cols = np.arange(len(self.years))[years][present.any(axis=0)]
+        return MatrixPivot(self, gas, rows, cols)
+
+
+def _cumulative(values):
+    dtype = np.min_scalar_type(int(values.sum(axis=1).max(initial=0))) if values.dtype.kind == 'u' else values.dtype
+    cumulative = np.zeros((values.shape[0], values.shape[1] + 1), dtype=dtype)
+    np.cumsum(values, axis=1, out=cumulative[:, 1:])
+    return cumulative
+
+
+def _by_sector(cumulative, codes, n_sectors):
+    totals = np.zeros((n_sectors, cumulative.shape[1]), dtype=cumulative.dtype if cumulative.dtype.kind == 'f' else np.int64)
+    np.add.at(totals, codes, cumulative)
+    return totals
+
+
+# Lazily materialized slice of the matrix; frame(start, stop) builds only the
+# requested rows so large results can be paged to the UI
+class MatrixPivot:
+    def __init__(self, matrix, gas, rows, cols):
+        self._matrix = matrix
+        self._gas = gas
+        self._rows = rows
+        self._cols = cols
+
+    def __len__(self):
+        return len(self._rows)
+
+    def frame(self, start=0, stop=None):
+        rows = self._rows[start:stop]
+        grid = np.ix_(rows, self._cols)
+        sums = self._matrix.sums[self._gas][grid]
+        counts = self._matrix.counts[self._gas][grid]
+        values = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        columns = pd.Index(self._matrix.years[self._cols], name='Year')
+        return pd.DataFrame(values, index=self._matrix.facilities[rows], columns=columns)
+
+
+# Same paging interface over an already computed pivot frame
+class FramePivot:
+    def __init__(self, frame):
+        self._frame = frame
+
+    def __len__(self):
+        return len(self._frame)
+
+    def frame(self, start=0, stop=None):
+        return self._frame.iloc[start:stop]
+
+
+# Emissions matrix of a frame loaded through the data store (None otherwise)
+def get_emissions_matrix(data):
+    dataset = lookup_dataset(data)
+    if dataset is None:
+        return None
+    return dataset.derived('emissions_matrix', EmissionsMatrix)
@@ -0,0 +1,136 @@
+import os
+import re
+import tempfile
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from utils import columnar_store, utils_company, utils_location
+from utils.data_store import DATA_PATH
+from utils.profiling import profiled
+
+# Rows per exported chunk: one CSV block or one Parquet row group
+EXPORT_BATCH_ROWS = int(os.environ.get('EMISSIONS_EXPORT_BATCH_ROWS', 64 * 1024))
+# Base URL of a running query service (python -m utils.query_service); when set,
+# pages link to its streaming export endpoints instead of preparing the file in the app
+EXPORT_API_URL = os.environ.get('EMISSIONS_API_URL', '').rstrip('/')
+
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+
+# Consecutive slices of an in-memory frame, each a view rather than a copy
+def _slices(frame, batch_rows):
+    if frame.empty:
+        yield frame
+    for start in range(0, len(frame), batch_rows):
+        yield frame.iloc[start:start + batch_rows]
+
+
+# Rows of the Location page's view (utils_location.filter_data), batch by batch.
+# Columnar stores stream the state's row groups; a city filter is applied per batch.
+def location_batches(state, city=None, file_path=DATA_PATH, batch_rows=EXPORT_BATCH_ROWS):
+    if not columnar_store.is_store(file_path):
+        yield from _slices(utils_location.load_location_data(state, city, file_path), batch_rows)
+        return
+    for batch in columnar_store.iter_batches(file_path, batch_rows, states=[state]):
+        yield utils_location.filter_data(batch, city=city) if city else batch
+
+
+# Rows of the Company page's view (utils_company.filter_data: the matching
+# facilities within the year range), batch by batch
+def company_batches(company_name, date_range, file_path=DATA_PATH, batch_rows=EXPORT_BATCH_ROWS):
+    if not columnar_store.is_store(file_path):
+        data, _ = utils_company.filter_data(utils_company.load_data(file_path), company_name, date_range,
+                                            utils_company.EMISSION_TYPES[0])
+        yield from _slices(data, batch_rows)
+        return
+    names = utils_company.load_matching_companies(company_name, file_path)
+    yield from columnar_store.iter_batches(file_path, batch_rows, years=tuple(date_range), facilities=names)
+
+
+# Encode frames as one CSV document, a chunk of bytes per frame
+def iter_csv(batches):
+    header = True
+    for batch in batches:
+        yield batch.to_csv(index=False, header=header).encode()
+        header = False
+
+
+# Write-only file object handing out what has been written since the last take()
+class _Drain:
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Encode frames as one Parquet file, a row group (and its bytes) per frame
+def iter_parquet(batches):
+    sink = _Drain()
+    writer = None
+    for batch in batches:
+        # Categories differ between batches, so write text columns as plain strings
+        batch = batch.astype({col: 'string' for col in batch.columns if batch[col].dtype.name in ('category', 'object')})
+        table = pa.Table.from_pandas(batch, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+        yield sink.take()
+
+
+def encode(batches, export_format):
+    return iter_parquet(batches) if export_format == 'parquet' else iter_csv(batches)
+
+
+# Content-Disposition value for a download named after user input: control
+# characters, quotes and path separators are replaced, with an ASCII fallback
+# name and the full name as RFC 5987 UTF-8
+def content_disposition(file_name):
+    file_name = re.sub(r'[\x00-\x1f\x7f"\\/]', '_', file_name)
+    fallback = re.sub(r'[^A-Za-z0-9._ -]', '_', file_name)
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(file_name, safe="")}'
+
+
+# Export controls for a page view. With a query service configured the link
+# streams the file from it. Otherwise the file is encoded batch by batch into a
+# temporary file that the download button is given; st.download_button keeps the
+# payload in Streamlit's media store, so only the query service streams end to end.
+@profiled
+def render_download(file_stem, batches, api_path):
+    export_format = st.selectbox('Export format', list(FORMATS), key=f'{file_stem}-format')
+    mime, extension = FORMATS[export_format]
+    if EXPORT_API_URL:
+        st.link_button(f'Download {export_format.upper()}', f'{EXPORT_API_URL}{api_path}&format={export_format}')
+    elif st.button(f'Prepare {export_format.upper()} download', key=f'{file_stem}-prepare'):
+        fd, path = tempfile.mkstemp(suffix=extension)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in encode(batches(), export_format):
+                    f.write(chunk)
+            with open(path, 'rb') as data:
+                st.download_button(f'Download {export_format.upper()}', data, file_name=f'{file_stem}{extension}',
+                                   mime=mime, key=f'{file_stem}-download')
+        finally:
+            os.remove(path)
@@ -0,0 +1,111 @@
+import bisect
+import itertools
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from utils.data_store import source_dataset
+
+
+def normalize_name(name):
+    return str(name).lower()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Lookup structure over the distinct facility names of a dataset:
+# name -> row positions, trigram -> names for substring queries and a sorted
+# name list for prefix autocomplete
+class FacilityIndex:
+    def __init__(self, names):
+        if not isinstance(names.dtype, pd.CategoricalDtype):
+            names = names.astype('category')
+        self.dtype = names.dtype
+        self.names = [str(name) for name in names.cat.categories]
+        self.n_rows = len(names)
+        self._normalized = [normalize_name(name) for name in self.names]
+        self._ids = {name: name_id for name_id, name in enumerate(self.names)}
+
+        # Row positions of each name, stored as one permutation plus offsets
+        codes = names.cat.codes.to_numpy()
+        self._order = np.argsort(codes, kind='stable')
+        self._offsets = np.searchsorted(codes[self._order], np.arange(len(self.names) + 1))
+
+        postings = defaultdict(list)
+        for name_id, name in enumerate(self._normalized):
+            for trigram in _trigrams(name):
+                postings[trigram].append(name_id)
+        self._trigrams = {trigram: np.array(ids, dtype=np.int32) for trigram, ids in postings.items()}
+
+        self._sorted = sorted(zip(self._normalized, range(len(self.names))))
+        self._sorted_keys = [key for key, _ in self._sorted]
+
+    # Ids of the names containing query, case-insensitively (a literal substring match)
+    def match_ids(self, query):
+        query = normalize_name(query)
+        if not query:
+            return np.arange(len(self.names))
+        if len(query) < 3:
+            return np.array([i for i, name in enumerate(self._normalized) if query in name], dtype=np.int32)
+
+        candidates = None
+        for trigram in sorted(_trigrams(query), key=lambda t: len(self._trigrams.get(t, ()))):
+            ids = self._trigrams.get(trigram)
+            if ids is None:
+                return np.array([], dtype=np.int32)
+            candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+        return np.array([i for i in candidates if query in self._normalized[i]], dtype=np.int32)
+
+    def matching_names(self, query):
+        return [self.names[i] for i in self.match_ids(query)]
+
+    # Ids of these exact names, skipping names that are not indexed
+    def name_ids(self, names):
+        return np.array([self._ids[name] for name in names if name in self._ids], dtype=np.int32)
+
+    # Sorted positions, in the indexed frame, of the rows of these name ids
+    def rows_of(self, ids):
+        if len(ids) == 0:
+            return np.array([], dtype=np.intp)
+        rows = np.concatenate([self._order[self._offsets[i]:self._offsets[i + 1]] for i in ids])
+        rows.sort()
+        return rows
+
+    # Sorted positions, in the indexed frame, of the rows matching query
+    def rows(self, query):
+        return self.rows_of(self.match_ids(query))
+
+    # Boolean mask over any facility column sharing the indexed categories
+    def mask(self, names, query):
+        return np.isin(names.cat.codes.to_numpy(), self.match_ids(query))
+
+    # Names starting with query first, then other names containing it
+    def suggest(self, query, limit=10):
+        query = normalize_name(query)
+        start = bisect.bisect_left(self._sorted_keys, query)
+        suggestions = []
+        for key, name_id in itertools.islice(self._sorted, start, start + limit):
+            if not key.startswith(query):
+                break
+            suggestions.append(name_id)
+        if len(suggestions) < limit:
+            seen = set(suggestions)
+            for name_id in self.match_ids(query):
+                if name_id not in seen:
+                    suggestions.append(name_id)
+                    if len(suggestions) >= limit:
+                        break
+        return [self.names[i] for i in suggestions]
+
+
+# Facility index of the store dataset data comes from (None for frames not
+# loaded through the store)
+def get_facility_index(data):
+    dataset = source_dataset(data)
+    if dataset is None:
+        return None
+    return dataset.derived('facility_index', lambda frame: FacilityIndex(frame['Facility.Name']))
@@ -0,0 +1,104 @@
+import functools
+import os
+import threading
+
+from cachetools import LRUCache
+
+try:
+    # Plotly imports its orjson encoder on first use behind a bare sys.modules
+    # check, which hands chart threads racing that import a half-initialized
+    # module; importing it here, under the regular import lock, avoids that
+    import orjson  # noqa: F401
+except ImportError:
+    pass
+
+FIGURE_CACHE_SIZE = int(os.environ.get('EMISSIONS_FIGURE_CACHE_SIZE', 256))
+
+# Altair keeps its data transformer and schema validator process-wide and
+# st.altair_chart switches the transformer while it marshals a chart, so Altair
+# serialization and rendering from concurrent sessions or chart threads take
+# turns on this lock
+altair_lock = threading.RLock()
+
+
+# Chart libraries are imported on first use, so a page only loads the backend it draws with
+def _serialize(figure):
+    if type(figure).__module__.startswith('altair'):
+        with altair_lock:
+            return 'altair', figure.to_json()
+    return 'plotly', figure.to_json()
+
+
+def _deserialize(payload):
+    kind, spec = payload
+    if kind == 'altair':
+        import altair as alt
+        with altair_lock:
+            return alt.Chart.from_json(spec, validate=False)
+    import plotly.io as pio
+    return pio.from_json(spec)
+
+
+# Process-wide, size-bounded store of serialized Plotly/Altair figures
+class FigureCache:
+    def __init__(self, maxsize=FIGURE_CACHE_SIZE):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Figure for key, built (and serialized) only when it is not cached yet
+    def get_or_build(self, key, build):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if payload is not None:
+            return _deserialize(payload)
+
+        figure = build()
+        payload = _serialize(figure)
+        with self._lock:
+            self._entries[key] = payload
+        return figure
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self._entries.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+figure_cache = FigureCache()
+
+
+# st.altair_chart under the Altair lock; use it instead of calling Streamlit directly
+def altair_chart(chart, **kwargs):
+    import streamlit as st
+
+    with altair_lock:
+        return st.altair_chart(chart, **kwargs)
+
+
+# Route a chart builder through the figure cache. The decorated builder takes an
+# extra cache_key keyword describing its input data (dataset version and the
+# filters that produced it); its remaining arguments after the data are hashable
+# chart parameters and become part of the key. Without a cache_key the builder
+# runs uncached.
+def cached_chart(chart_id):
+    def decorator(build):
+        @functools.wraps(build)
+        def wrapper(data, *args, cache_key=None, **kwargs):
+            if cache_key is None:
+                return build(data, *args, **kwargs)
+            key = (chart_id, cache_key, args, tuple(sorted(kwargs.items())))
+            return figure_cache.get_or_build(key, lambda: build(data, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,56 @@
+import argparse
+import re
+import subprocess
+import sys
+
+# What each entry point imports: the app shell runs on every rerun, the rest
+# only when their page is selected
+TARGETS = {
+    'app shell': ['streamlit', 'pages', 'utils.chart_tasks', 'utils.data_store', 'utils.profiling', 'utils.warmup'],
+    'Home': ['utils.utils_home'],
+    'Company Insights': ['pages.company'],
+    'Location Insights': ['pages.location'],
+    'Chat': ['utils.chat'],
+}
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+# Import modules in a fresh interpreter under -X importtime. Returns
+# (module, self_us, cumulative_us, depth) rows in import order; modules already
+# imported by the preload list are not counted.
+def profile_imports(modules, preload=()):
+    code = ''.join(f'import {module}\n' for module in preload)
+    code += 'import sys\nsys.stderr.write("--- profile ---\\n")\n'
+    code += ''.join(f'import {module}\n' for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in result.stderr.split('--- profile ---\n', 1)[1].splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+# Import time of each page on top of the app shell, with its slowest modules
+def report(top=10):
+    lines = []
+    shell = TARGETS['app shell']
+    for name, modules in TARGETS.items():
+        preload = () if name == 'app shell' else shell
+        rows = profile_imports(modules, preload)
+        total_us = sum(cumulative for _, _, cumulative, depth in rows if depth == 0)
+        lines.append(f'{name}: {total_us / 1000:.0f} ms, {len(rows)} modules')
+        for module, self_us, cumulative_us, _ in sorted(rows, key=lambda row: -row[1])[:top]:
+            lines.append(f'    {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {module}')
+    return '\n'.join(lines)
+
+
+# python -m utils.import_profile [--top N]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report import time of the app shell and each page')
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list per entry point')
+    print(report(parser.parse_args().top))
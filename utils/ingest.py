@@ -0,0 +1,180 @@
+import argparse
+import os
+import re
+import sys
+
+import pandas as pd
+import pyarrow as pa
+from utils.columnar_store import (NUMERIC_COLUMNS, OPTIONAL_NUMERIC_COLUMNS, STRING_COLUMNS, StoreWriter, columns,
+                                  is_store, read_manifest, source_fingerprint)
+
+REQUIRED_COLUMNS = STRING_COLUMNS + ['Year'] + NUMERIC_COLUMNS
+CHUNK_ROWS = 500_000
+
+US_STATE_CODES = {
+    'ALABAMA': 'AL', 'ALASKA': 'AK', 'ARIZONA': 'AZ', 'ARKANSAS': 'AR', 'CALIFORNIA': 'CA',
+    'COLORADO': 'CO', 'CONNECTICUT': 'CT', 'DELAWARE': 'DE', 'DISTRICT OF COLUMBIA': 'DC',
+    'FLORIDA': 'FL', 'GEORGIA': 'GA', 'HAWAII': 'HI', 'IDAHO': 'ID', 'ILLINOIS': 'IL',
+    'INDIANA': 'IN', 'IOWA': 'IA', 'KANSAS': 'KS', 'KENTUCKY': 'KY', 'LOUISIANA': 'LA',
+    'MAINE': 'ME', 'MARYLAND': 'MD', 'MASSACHUSETTS': 'MA', 'MICHIGAN': 'MI', 'MINNESOTA': 'MN',
+    'MISSISSIPPI': 'MS', 'MISSOURI': 'MO', 'MONTANA': 'MT', 'NEBRASKA': 'NE', 'NEVADA': 'NV',
+    'NEW HAMPSHIRE': 'NH', 'NEW JERSEY': 'NJ', 'NEW MEXICO': 'NM', 'NEW YORK': 'NY',
+    'NORTH CAROLINA': 'NC', 'NORTH DAKOTA': 'ND', 'OHIO': 'OH', 'OKLAHOMA': 'OK', 'OREGON': 'OR',
+    'PENNSYLVANIA': 'PA', 'RHODE ISLAND': 'RI', 'SOUTH CAROLINA': 'SC', 'SOUTH DAKOTA': 'SD',
+    'TENNESSEE': 'TN', 'TEXAS': 'TX', 'UTAH': 'UT', 'VERMONT': 'VT', 'VIRGINIA': 'VA',
+    'WASHINGTON': 'WA', 'WEST VIRGINIA': 'WV', 'WISCONSIN': 'WI', 'WYOMING': 'WY',
+    'PUERTO RICO': 'PR', 'GUAM': 'GU', 'VIRGIN ISLANDS': 'VI', 'AMERICAN SAMOA': 'AS',
+    'NORTHERN MARIANA ISLANDS': 'MP',
+}
+_STATE_CODE = re.compile(r'^[A-Z]{2}$')
+
+
+def store_schema(columns):
+    fields = [(col, pa.string()) for col in STRING_COLUMNS]
+    fields += [(col, pa.float64()) for col in NUMERIC_COLUMNS]
+    fields += [(col, pa.float64()) for col in OPTIONAL_NUMERIC_COLUMNS if col in columns]
+    return pa.schema(fields)
+
+
+def _normalize_states(states):
+    states = states.str.strip().str.upper()
+    states = states.where(~states.isin(US_STATE_CODES.keys()), states.map(US_STATE_CODES))
+    return states.where(states.str.match(_STATE_CODE, na=False))
+
+
+# Validate and normalize one raw chunk: USPS state codes, uppercased facility
+# names, numeric years and emissions. Returns the clean rows and the number of
+# rows dropped for a missing facility, state or year.
+def normalize_chunk(chunk):
+    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise ValueError(f'Source is missing columns: {", ".join(missing)}')
+
+    chunk = chunk.copy()
+    chunk['Facility.Name'] = chunk['Facility.Name'].str.strip().str.upper().str.replace(r'\s+', ' ', regex=True)
+    chunk['City'] = chunk['City'].str.strip()
+    chunk['Sector'] = chunk['Sector'].str.strip()
+    chunk['State'] = _normalize_states(chunk['State'])
+    chunk['Year'] = pd.to_numeric(chunk['Year'], errors='coerce')
+    for col in NUMERIC_COLUMNS + OPTIONAL_NUMERIC_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+
+    valid = chunk['Facility.Name'].notna() & (chunk['Facility.Name'] != '') & chunk['State'].notna() & chunk['Year'].notna()
+    clean = chunk[valid]
+    clean = clean.assign(Year=clean['Year'].astype('int16'))
+    return clean, int((~valid).sum())
+
+
+class _Ingestion:
+    def __init__(self, store_path, chunk_rows, log, replace_years=()):
+        self.store_path = store_path
+        self.chunk_rows = chunk_rows
+        self.log = log
+        self.replace_years = replace_years
+        self.writer = None
+        self.rejected = 0
+        self.sources = {}
+
+    # Append one source's rows (only those in years, when given) to the store
+    def add(self, source, years=None):
+        source_years = set()
+        for chunk in pd.read_csv(source, chunksize=self.chunk_rows, dtype=str):
+            clean, dropped = normalize_chunk(chunk)
+            self.rejected += dropped
+            source_years.update(int(year) for year in clean['Year'].unique())
+            if years is not None:
+                clean = clean[clean['Year'].isin(years)]
+            if clean.empty:
+                continue
+            if self.writer is None:
+                self.writer = StoreWriter(self.store_path, store_schema(clean.columns))
+            self.writer.write(clean)
+            if self.log:
+                self.log(f'{source}: {sum(self.writer.rows.values()):,} rows written, {self.rejected:,} rejected')
+        self.sources[os.path.abspath(source)] = {'fingerprint': source_fingerprint(source), 'years': sorted(source_years)}
+        return source_years
+
+    # Remove the files written so far, leaving the store as it was
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+
+    def close(self):
+        if self.writer is None:
+            if not self.replace_years:
+                raise ValueError('No rows to ingest')
+            # The replaced years have no rows left; publish them as removed
+            self.writer = StoreWriter(self.store_path, store_schema(columns(self.store_path)))
+        manifest = self.writer.close(self.sources, self.replace_years)
+        manifest['rejected'] = self.rejected
+        return manifest
+
+
+# Stream source CSVs into the columnar store at store_path chunk by chunk, so
+# resident memory is bounded by the chunk size rather than the source size
+def ingest(sources, store_path, chunk_rows=CHUNK_ROWS, log=None):
+    ingestion = _Ingestion(store_path, chunk_rows, log)
+    try:
+        for source in sources:
+            ingestion.add(source)
+        return ingestion.close()
+    except BaseException:
+        ingestion.abort()
+        raise
+
+
+# Bring the store up to date with sources, rewriting only the years touched by
+# sources that are new or changed since they were last ingested. Other known
+# sources contributing to those years are re-read for just those years.
+# Returns the new manifest, or None when nothing changed.
+def refresh(sources, store_path, chunk_rows=CHUNK_ROWS, log=None):
+    if not is_store(store_path):
+        return ingest(sources, store_path, chunk_rows, log)
+
+    known = read_manifest(store_path)['sources']
+    changed = [source for source in sources
+               if known.get(os.path.abspath(source), {}).get('fingerprint') != source_fingerprint(source)]
+    if not changed:
+        return None
+
+    affected = set()
+    for source in changed:
+        affected.update(known.get(os.path.abspath(source), {}).get('years', []))
+    ingestion = _Ingestion(store_path, chunk_rows, log, replace_years=affected)
+    try:
+        for source in changed:
+            affected.update(ingestion.add(source))
+
+        changed_paths = {os.path.abspath(source) for source in changed}
+        unchanged = [path for path, entry in known.items()
+                     if path not in changed_paths and affected.intersection(entry['years'])]
+        missing = [path for path in unchanged if not os.path.exists(path)]
+        if missing:
+            raise ValueError(f'Sources needed to rebuild years {sorted(affected)} are missing: {", ".join(missing)}')
+        for path in unchanged:
+            ingestion.add(path, years=affected)
+        return ingestion.close()
+    except BaseException:
+        ingestion.abort()
+        raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest EPA CSV extracts into a columnar emissions store')
+    parser.add_argument('sources', nargs='+', help='CSV files with the Processed_Unit.csv columns')
+    parser.add_argument('--store', default='data/store', help='store directory to create or append to')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--refresh', action='store_true',
+                        help='only re-ingest new or changed sources, replacing the years they cover')
+    args = parser.parse_args()
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    if args.refresh:
+        manifest = refresh(args.sources, args.store, args.chunk_rows, log)
+        if manifest is None:
+            print(f'{args.store}: up to date')
+            sys.exit(0)
+    else:
+        manifest = ingest(args.sources, args.store, args.chunk_rows, log)
+    print(f'{args.store}: version {manifest["version"]}, {manifest["rows"]:,} rows, {manifest["rejected"]:,} rejected')
@@ -0,0 +1,175 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from cachetools import LRUCache
+from utils import columnar_store
+from utils.data_store import DATA_PATH, get_data, scan, source_derived, source_version
+from utils.profiling import profiled
+
+# Most points a map view draws; views with more pick a coarser detail level
+MAP_POINT_LIMIT = int(os.environ.get('EMISSIONS_MAP_POINT_LIMIT', 5000))
+# Grid cell size in degrees of the level between cities and single facilities
+GRID_DEGREES = 0.25
+MAP_CACHE_SIZE = 64
+EMISSION_COL = 'CO2_eq_emissions'
+
+# Approximate geographic centers, used to place state totals when the data has
+# no facility coordinates
+STATE_CENTROIDS = {
+    'AL': (32.8, -86.8), 'AK': (64.7, -152.0), 'AZ': (34.3, -111.7), 'AR': (34.9, -92.4), 'CA': (37.2, -119.4),
+    'CO': (39.0, -105.5), 'CT': (41.6, -72.7), 'DE': (39.0, -75.5), 'DC': (38.9, -77.0), 'FL': (28.6, -82.4),
+    'GA': (32.7, -83.4), 'HI': (20.3, -156.4), 'ID': (44.4, -114.6), 'IL': (40.0, -89.2), 'IN': (39.9, -86.3),
+    'IA': (42.1, -93.5), 'KS': (38.5, -98.4), 'KY': (37.5, -85.3), 'LA': (31.1, -92.0), 'ME': (45.4, -69.2),
+    'MD': (39.0, -76.8), 'MA': (42.3, -71.8), 'MI': (44.3, -85.4), 'MN': (46.3, -94.3), 'MS': (32.7, -89.7),
+    'MO': (38.4, -92.5), 'MT': (47.0, -109.6), 'NE': (41.5, -99.8), 'NV': (39.3, -116.6), 'NH': (43.7, -71.6),
+    'NJ': (40.2, -74.7), 'NM': (34.4, -106.1), 'NY': (42.9, -75.5), 'NC': (35.6, -79.4), 'ND': (47.5, -100.5),
+    'OH': (40.3, -82.8), 'OK': (35.6, -97.5), 'OR': (43.9, -120.6), 'PA': (40.9, -77.8), 'PR': (18.2, -66.5),
+    'RI': (41.7, -71.5), 'SC': (33.9, -80.9), 'SD': (44.4, -100.2), 'TN': (35.9, -86.4), 'TX': (31.5, -99.3),
+    'UT': (39.3, -111.7), 'VT': (44.1, -72.7), 'VA': (37.5, -78.9), 'WA': (47.4, -120.5), 'WV': (38.6, -80.6),
+    'WI': (44.6, -89.9), 'WY': (43.0, -107.6),
+}
+# Largest circle radius in metres per detail level
+_MAX_RADIUS = {'States': 150_000, 'Cities': 40_000, 'Grid': 20_000, 'Facilities': 8_000}
+
+
+# One row per facility: location, coordinates (when the data has them) and
+# all-years emissions
+def facility_points(data):
+    keys = ['Facility.Name', 'City', 'State']
+    values = {EMISSION_COL: 'sum'}
+    if {'Latitude', 'Longitude'} <= set(data.columns):
+        values.update(Latitude='mean', Longitude='mean')
+    points = data.groupby(keys, observed=True).agg(values).reset_index()
+    for col in keys:
+        points[col] = points[col].astype(str)
+    return points
+
+
+# Points of one detail level: per state, per city, per grid cell (never spanning
+# two states, so state filters stay exact) or per facility, each with its
+# facility count, summed emissions and the mean position of its facilities
+def _cluster(points, keys, label):
+    grouped = points.groupby(keys, sort=False)
+    level = grouped.agg(Latitude=('Latitude', 'mean'), Longitude=('Longitude', 'mean'),
+                        facilities=(EMISSION_COL, 'size'), emissions=(EMISSION_COL, 'sum')).reset_index()
+    level['label'] = label(level)
+    return level[['State', 'label', 'Latitude', 'Longitude', 'facilities', 'emissions']]
+
+
+# Precomputed map points of a dataset at every detail level, coarse to fine
+class MapLayers:
+    def __init__(self, points):
+        self.has_coordinates = 'Latitude' in points.columns
+        if not self.has_coordinates:
+            centroids = points['State'].map(STATE_CENTROIDS)
+            points = points[centroids.notna()].assign(Latitude=centroids.str[0], Longitude=centroids.str[1])
+        else:
+            points = points.dropna(subset=['Latitude', 'Longitude'])
+
+        self.levels = {'States': _cluster(points, ['State'], lambda level: level['State'])}
+        if self.has_coordinates:
+            cells = points.assign(row=np.floor(points['Latitude'] / GRID_DEGREES).astype(int),
+                                  col=np.floor(points['Longitude'] / GRID_DEGREES).astype(int))
+            self.levels['Cities'] = _cluster(points, ['State', 'City'], lambda level: level['City'] + ', ' + level['State'])
+            self.levels['Grid'] = _cluster(cells, ['State', 'row', 'col'],
+                                           lambda level: level['facilities'].astype(str) + ' facilities near ' +
+                                           level['Latitude'].round(2).astype(str) + ', ' + level['Longitude'].round(2).astype(str))
+            self.levels['Facilities'] = _cluster(points, ['State', 'Facility.Name', 'City'],
+                                                 lambda level: level['Facility.Name'] + ' (' + level['City'] + ')')
+        # Row range of each state in every level, so scoped views are slices
+        self._ranges = {}
+        for name, level in self.levels.items():
+            level = level.sort_values(['State', 'emissions'], ascending=[True, False], ignore_index=True)
+            self.levels[name] = level
+            ends = level.groupby('State', sort=False).size().cumsum()
+            self._ranges[name] = dict(zip(ends.index, zip(ends.shift(fill_value=0).astype(int), ends.astype(int))))
+
+    # Points of a level, limited to some states
+    def points(self, level, states=None):
+        frame = self.levels[level]
+        if not states:
+            return frame
+        ranges = self._ranges[level]
+        parts = [frame.iloc[ranges[state][0]:ranges[state][1]] for state in states if state in ranges]
+        return pd.concat(parts, ignore_index=True) if parts else frame.iloc[:0]
+
+    # Finest level whose points in the view fit the point budget
+    def auto_level(self, states=None, limit=MAP_POINT_LIMIT):
+        fitting = [name for name in self.levels if len(self.points(name, states)) <= limit]
+        return fitting[-1] if fitting else next(iter(self.levels))
+
+
+def _store_points(file_path):
+    available = columnar_store.columns(file_path)
+    columns = ['Facility.Name', 'City', 'State', EMISSION_COL] + [col for col in ['Latitude', 'Longitude'] if col in available]
+    return facility_points(scan(file_path, columns=columns))
+
+
+# Map layers of a source, built once per dataset version
+@profiled
+def get_map_layers(file_path=DATA_PATH):
+    def build(path):
+        if columnar_store.is_store(path):
+            return MapLayers(_store_points(path))
+        return MapLayers(facility_points(get_data(path)))
+    return source_derived(file_path, 'map_layers', build)
+
+
+_decks = LRUCache(maxsize=MAP_CACHE_SIZE)
+_decks_lock = threading.Lock()
+
+
+def _build_deck(points, level, zoom):
+    import pydeck as pdk
+
+    # Only what the layer and tooltip use, rounded, since the points are inlined in the page
+    points = pd.DataFrame({
+        'label': points['label'],
+        'Latitude': points['Latitude'].round(4),
+        'Longitude': points['Longitude'].round(4),
+        'radius': (np.sqrt(points['emissions'] / max(points['emissions'].max(), 1e-9)) * _MAX_RADIUS[level]).round(),
+        'facilities': points['facilities'].astype(int),
+        'emissions_label': points['emissions'].map('{:,.0f}'.format),
+    })
+    layer = pdk.Layer('ScatterplotLayer', data=points, get_position=['Longitude', 'Latitude'], get_radius='radius',
+                      radius_min_pixels=2, radius_max_pixels=40, get_fill_color=[227, 74, 51, 160],
+                      stroked=True, get_line_color=[255, 255, 255], line_width_min_pixels=0.5, pickable=True)
+    view = pdk.ViewState(latitude=float(points['Latitude'].mean()) if len(points) else 39.5,
+                         longitude=float(points['Longitude'].mean()) if len(points) else -98.35, zoom=zoom)
+    tooltip = {'text': '{label}\n{facilities} facilities\n{emissions_label} MT CO2e'}
+    return pdk.Deck(layers=[layer], initial_view_state=view, tooltip=tooltip, map_style=None)
+
+
+# WebGL (pydeck) map of a view, cached per dataset version, scope and level
+@profiled
+def facility_map(file_path=DATA_PATH, states=None, level=None):
+    layers = get_map_layers(file_path)
+    states = tuple(sorted(states)) if states else ()
+    level = level if level in layers.levels else layers.auto_level(states)
+    key = (os.path.abspath(file_path), source_version(file_path), states, level)
+    with _decks_lock:
+        deck = _decks.get(key)
+    if deck is None:
+        deck = _build_deck(layers.points(level, states), level, 5 if len(states) == 1 else 3)
+        with _decks_lock:
+            _decks[key] = deck
+    return deck, level
+
+
+# Facility map of a state, or of every state, with the detail level picked
+# automatically or from the levels that fit the point budget
+@profiled
+def plot_facility_map(state, file_path=DATA_PATH):
+    import streamlit as st
+
+    layers = get_map_layers(file_path)
+    states = None if st.checkbox('Show all states', key='map-all-states') else (state,)
+    fitting = [name for name in layers.levels if len(layers.points(name, states)) <= MAP_POINT_LIMIT]
+    choice = st.select_slider('Detail', ['Auto'] + fitting, key='map-detail') if len(fitting) > 1 else 'Auto'
+    deck, level = facility_map(file_path, states, None if choice == 'Auto' else choice)
+    st.pydeck_chart(deck, use_container_width=True)
+    note = '' if layers.has_coordinates else ' The dataset has no facility coordinates, so totals sit at state centers.'
+    count = len(layers.points(level, states))
+    st.caption(f'{count:,} point{"" if count == 1 else "s"} at {level.lower()} level.{note}')
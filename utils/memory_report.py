@@ -0,0 +1,74 @@
+import sys
+
+import numpy as np
+import pandas as pd
+from utils import columnar_store
+from utils.data_store import DATA_PATH, get_dataset
+
+
+# Bytes held by a frame, array or the arrays/frames in an object's attributes
+def nbytes(obj, _depth=0):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum()) if isinstance(obj, pd.DataFrame) else int(obj.memory_usage(deep=True))
+    if isinstance(obj, pd.Index):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if _depth > 2:
+        return 0
+    if isinstance(obj, dict):
+        return sum(nbytes(value, _depth + 1) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(value, _depth + 1) for value in obj)
+    if hasattr(obj, '__dict__'):
+        return nbytes(vars(obj), _depth + 1)
+    return 0
+
+
+# Per-column dtype and deep memory use of a frame
+def memory_report(data):
+    usage = data.memory_usage(deep=True, index=False)
+    return pd.DataFrame({'column': usage.index, 'dtype': [str(data[col].dtype) for col in usage.index],
+                         'mb': usage.to_numpy() / 2 ** 20})
+
+
+def _raw_frame(file_path):
+    if columnar_store.is_store(file_path):
+        return columnar_store.read(file_path)
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path)
+    return pd.read_csv(file_path)
+
+
+# Raw (as read) versus compact (as held by the data store) memory use per column,
+# plus the derived structures built on the shared dataset so far
+def compare(file_path=DATA_PATH):
+    raw = memory_report(_raw_frame(file_path)).set_index('column')
+    dataset = get_dataset(file_path)
+    compact = memory_report(dataset.frame).set_index('column')
+    report = raw.join(compact, lsuffix='_raw', rsuffix='_compact', how='left').reset_index()
+    derived = pd.DataFrame([{'column': f'[{name}]', 'mb_compact': nbytes(value) / 2 ** 20}
+                            for name, value in dataset.derived_structures().items()])
+    return pd.concat([report, derived], ignore_index=True)
+
+
+# python -m utils.memory_report [path] [--derived]
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    path = args[0] if args else DATA_PATH
+    if '--derived' in sys.argv:
+        # Build the structures the pages use so their footprint is included
+        from utils.emissions_matrix import get_emissions_matrix
+        from utils.facility_index import get_facility_index
+        from utils.state_partitions import get_state_partitions
+
+        data = get_dataset(path).frame
+        get_facility_index(data), get_emissions_matrix(data), get_state_partitions(data)
+
+    report = compare(path)
+    with pd.option_context('display.width', 120, 'display.float_format', '{:.2f}'.format):
+        print(report.to_string(index=False))
+    frame_rows = ~report['column'].str.startswith('[')
+    raw_mb, compact_mb = report.loc[frame_rows, 'mb_raw'].sum(), report.loc[frame_rows, 'mb_compact'].sum()
+    print(f'table: {raw_mb:.2f} MB raw, {compact_mb:.2f} MB compact ({raw_mb / compact_mb:.1f}x smaller)')
+    print(f'derived structures: {report.loc[~frame_rows, "mb_compact"].sum():.2f} MB')
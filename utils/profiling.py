@@ -0,0 +1,156 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+# Profile every call in the process, or only reruns opened with ?debug=1
+PROFILE_ALL = os.environ.get('EMISSIONS_PROFILE', '') == '1'
+PROFILE_LOG = os.environ.get('EMISSIONS_PROFILE_LOG', 'logs/profile.jsonl')
+HISTORY_SIZE = 1000
+
+_history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+_history_lock = threading.Lock()
+# Streamlit runs each session's script on its own thread, so the current
+# rerun's records live in thread-local state
+_rerun = threading.local()
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, tuple):
+        for item in value:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return len(item)
+    frame = getattr(value, 'data', None)
+    if isinstance(frame, pd.DataFrame):
+        return len(frame)
+    return None
+
+
+def is_active():
+    return PROFILE_ALL or getattr(_rerun, 'debug', False)
+
+
+# Reset the per-rerun records; called at the top of every script run
+def start_rerun(debug=False):
+    _rerun.debug = debug
+    _rerun.records = []
+
+
+# The calling thread's rerun state, to hand to worker threads doing work for it
+def current_rerun():
+    return getattr(_rerun, 'debug', False), getattr(_rerun, 'records', None)
+
+
+# Attribute calls made on this (worker) thread to the given rerun
+@contextlib.contextmanager
+def attached(rerun):
+    previous = current_rerun()
+    _rerun.debug, _rerun.records = rerun
+    try:
+        yield
+    finally:
+        _rerun.debug, _rerun.records = previous
+
+
+def _record(entry):
+    with _history_lock:
+        _history[entry['function']].append(entry['wall_ms'])
+    records = getattr(_rerun, 'records', None)
+    if records is not None:
+        records.append(entry)
+
+
+# Record wall time, rows in/out and RSS delta of each call while profiling is active
+def profiled(fn):
+    name = f'{fn.__module__}.{fn.__qualname__}'
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not is_active():
+            return fn(*args, **kwargs)
+        rows_in = next((len(arg) for arg in args if isinstance(arg, pd.DataFrame)), None)
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        _record({
+            'function': name,
+            'wall_ms': (time.perf_counter() - start) * 1000,
+            'rows_in': rows_in,
+            'rows_out': _rows(result),
+            'rss_delta_mb': (_rss_bytes() - rss_before) / 2 ** 20,
+        })
+        return result
+    return wrapper
+
+
+def rerun_records():
+    return list(getattr(_rerun, 'records', []))
+
+
+# Per-function call count and wall time percentiles over the process history
+def summary():
+    with _history_lock:
+        history = {name: list(times) for name, times in _history.items()}
+    rows = []
+    for name, times in sorted(history.items()):
+        p50, p90, p99 = np.percentile(times, [50, 90, 99])
+        rows.append({'function': name, 'calls': len(times), 'mean_ms': float(np.mean(times)),
+                     'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99)})
+    return rows
+
+
+# Append the current summary to a JSON-lines log for offline analysis
+def export_summary(path=PROFILE_LOG):
+    rows = summary()
+    if not rows:
+        return None
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid(),
+                            'functions': rows}) + '\n')
+    return path
+
+
+# Sidebar panel with this rerun's calls, process-wide percentiles and cache counters
+def render_debug_panel():
+    if not is_active():
+        return
+    import streamlit as st
+    from utils import warmup
+    from utils.figure_cache import figure_cache
+
+    with st.sidebar.expander('Performance', expanded=True):
+        records = rerun_records()
+        st.caption(f'This rerun: {len(records)} calls, '
+                   f'{sum(r["wall_ms"] for r in records):.1f} ms recorded')
+        st.dataframe(pd.DataFrame(records), hide_index=True)
+        st.caption('All calls in this process')
+        st.dataframe(pd.DataFrame(summary()), hide_index=True)
+        st.caption(f'Figure cache: {figure_cache.stats()}')
+        st.caption(f'Warm-up: {warmup.status()}')
+        if st.button('Export to log'):
+            st.write(f'Written to {export_summary()}')
+
+
+if PROFILE_ALL:
+    atexit.register(export_summary)
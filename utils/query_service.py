@@ -0,0 +1,341 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import tornado.ioloop
+import tornado.web
+from cachetools import LRUCache
+from utils import export
+from utils.aggregates import ROLLUPS, get_aggregates
+from utils.data_store import DATA_PATH, EMISSION_COLUMNS, source_version
+from utils.utils_company import (DEFAULT_DATE_RANGE, EMISSION_TYPES, load_company_analysis, load_company_comparison,
+                                 load_company_suggestions)
+from utils.utils_location import load_location_data
+
+API_PORT = int(os.environ.get('EMISSIONS_API_PORT', 8502))
+API_WORKERS = int(os.environ.get('EMISSIONS_API_WORKERS', 4))
+RESPONSE_CACHE_SIZE = int(os.environ.get('EMISSIONS_API_CACHE_SIZE', 1024))
+# Most names or states a single batch request may ask for
+BATCH_LIMIT = 100
+
+
+class QueryError(ValueError):
+    pass
+
+
+# JSON-ready copy of query results: frames become lists of records, numpy
+# scalars become Python numbers and NaN becomes null
+def to_jsonable(value):
+    if isinstance(value, pd.DataFrame):
+        frame = value.astype({col: str for col in value.columns if isinstance(value[col].dtype, pd.CategoricalDtype)})
+        return [to_jsonable(record) for record in frame.to_dict(orient='records')]
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _int(params, name, default, minimum=None):
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        raise QueryError(f'{name} must be an integer')
+    if minimum is not None and value < minimum:
+        raise QueryError(f'{name} must be a positive integer' if minimum == 1 else f'{name} must be at least {minimum}')
+    return value
+
+
+def _emission_type(params):
+    emission_type = params.get('gas', EMISSION_TYPES[0])
+    if emission_type not in EMISSION_TYPES:
+        raise QueryError(f'gas must be one of {", ".join(EMISSION_TYPES)}')
+    return emission_type
+
+
+def _date_range(params):
+    return _int(params, 'start', DEFAULT_DATE_RANGE[0]), _int(params, 'end', DEFAULT_DATE_RANGE[1])
+
+
+def _batch(params, key):
+    values = params.get(key)
+    if not isinstance(values, list) or not values:
+        raise QueryError(f'{key} must be a non-empty list')
+    if len(values) > BATCH_LIMIT:
+        raise QueryError(f'at most {BATCH_LIMIT} {key} per request')
+    return [str(value) for value in values]
+
+
+def _selection(params):
+    start, end = _date_range(params)
+    return {'start': start, 'end': end, 'gas': _emission_type(params)}
+
+
+def _required(params, name):
+    value = params.get(name)
+    if not value:
+        raise QueryError(f'{name} is required')
+    return str(value)
+
+
+# Validated, normalized parameters of each query. They are checked before the
+# ETag or the cache are consulted, and the normalized form is what gets keyed on.
+def rollup_params(params):
+    name = params.get('name')
+    if name not in ROLLUPS:
+        raise QueryError(f'rollup must be one of {", ".join(ROLLUPS)}')
+    return {'name': name, 'limit': _int(params, 'limit', 10, minimum=1)}
+
+
+def company_params(params):
+    return {'name': _required(params, 'name'), **_selection(params)}
+
+
+def companies_params(params):
+    return {'names': _batch(params, 'names'), **_selection(params)}
+
+
+def suggest_params(params):
+    return {'q': str(params.get('q', '')), 'limit': _int(params, 'limit', 10, minimum=1)}
+
+
+def location_params(params):
+    city = params.get('city')
+    return {'state': _required(params, 'state'), 'city': str(city) if city else None}
+
+
+def locations_params(params):
+    city = params.get('city')
+    return {'states': _batch(params, 'states'), 'city': str(city) if city else None}
+
+
+# Top rows of one of the Home page rollups
+def rollup(file_path, params):
+    return get_aggregates(file_path)[params['name']].head(params['limit'])
+
+
+# What the Company page shows for one selection: calculate_metrics, the averages,
+# the sector comparison of calculate_sector_data and the yearly series
+def company(file_path, params, name=None):
+    name = name or params['name']
+    analysis = load_company_analysis(name, (params['start'], params['end']), params['gas'], file_path)
+    if analysis.data.empty:
+        return {'name': name, 'found': False}
+    total, max_year, max_value, avg_annual_increase = analysis.metrics
+    return {
+        'name': name,
+        'found': True,
+        'facilities': int(len(analysis.pivot)),
+        'metrics': {'total_emissions': total, 'max_emissions_year': max_year, 'max_emissions_value': max_value,
+                    'avg_annual_increase': avg_annual_increase},
+        'company_avg_emissions': analysis.company_avg_emissions,
+        'sector_avg_emissions': analysis.sector_avg_emissions,
+        'sector_comparison': analysis.top_companies,
+        'yearly': analysis.yearly,
+    }
+
+
+def companies(file_path, params):
+    return {name: company(file_path, params, name) for name in params['names']}
+
+
+# Metrics, sector ranks and yearly series of many facilities from one grouped pass
+def compare(file_path, params):
+    comparison = load_company_comparison(params['names'], (params['start'], params['end']), params['gas'], file_path)
+    return {'metrics': comparison.metrics, 'yearly': comparison.yearly}
+
+
+def suggest(file_path, params):
+    return load_company_suggestions(params['q'], file_path, params['limit'])
+
+
+# Emission totals of a state (or one of its cities), overall, by year and by sector
+def location(file_path, params, state=None):
+    state = state or params['state']
+    data = load_location_data(state, params['city'], file_path)
+    gases = [col for col in EMISSION_COLUMNS if col in data.columns]
+    return {
+        'state': state,
+        'city': params['city'],
+        'rows': len(data),
+        'totals': data[gases].sum().to_dict(),
+        'by_year': data.groupby('Year')[gases].sum().reset_index(),
+        'by_sector': data.groupby('Sector', observed=True)[gases].sum().reset_index()
+                         .sort_values('CO2_eq_emissions', ascending=False),
+    }
+
+
+def locations(file_path, params):
+    return {state: location(file_path, params, state) for state in params['states']}
+
+
+# Serialized responses keyed by dataset version, endpoint and normalized parameters
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            body = self._entries.get(key)
+        if body is None:
+            body = json.dumps(to_jsonable(compute()), allow_nan=False).encode()
+            with self._lock:
+                self._entries[key] = body
+        return body
+
+
+class QueryHandler(tornado.web.RequestHandler):
+    def initialize(self, query, validate, file_path, cache, executor):
+        self.query = query
+        self.validate = validate
+        self.file_path = file_path
+        self.cache = cache
+        self.executor = executor
+
+    def _params(self):
+        if self.request.method == 'POST':
+            try:
+                params = json.loads(self.request.body or b'{}')
+            except ValueError:
+                raise QueryError('body must be JSON')
+            if not isinstance(params, dict):
+                raise QueryError('body must be a JSON object')
+            return params
+        return {name: self.get_query_argument(name) for name in self.request.query_arguments}
+
+    async def _respond(self):
+        try:
+            params = self.validate(self._params())
+        except QueryError as exc:
+            raise tornado.web.HTTPError(400, reason=str(exc))
+        version = source_version(self.file_path)
+        key = (version, self.request.path, json.dumps(params, sort_keys=True))
+        # The ETag only depends on the dataset version and the validated query, so
+        # clients revalidating an unchanged query never trigger a computation and
+        # malformed ones get their 400 rather than a 304
+        etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+        self.set_header('ETag', etag)
+        self.set_header('X-Dataset-Version', version)
+        self.set_header('Cache-Control', 'no-cache')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            body = await loop.run_in_executor(
+                self.executor, self.cache.get_or_compute, key, lambda: self.query(self.file_path, params))
+        except QueryError as exc:
+            raise tornado.web.HTTPError(400, reason=str(exc))
+        self.set_header('Content-Type', 'application/json')
+        self.write(body)
+
+    # Tornado would compute its own ETag from the body; ours is set up front
+    def compute_etag(self):
+        return None
+
+    async def get(self):
+        await self._respond()
+
+    async def post(self):
+        await self._respond()
+
+
+# Streams an export as it is encoded, one batch at a time, so memory stays
+# bounded by the batch size however many rows the view has
+class ExportHandler(tornado.web.RequestHandler):
+    def initialize(self, batches, file_path, executor):
+        self.batches = batches
+        self.file_path = file_path
+        self.executor = executor
+
+    async def get(self):
+        params = {name: self.get_query_argument(name) for name in self.request.query_arguments}
+        export_format = params.get('format', 'csv')
+        if export_format not in export.FORMATS:
+            raise tornado.web.HTTPError(400, reason=f'format must be one of {", ".join(export.FORMATS)}')
+        try:
+            batches, file_stem = self.batches(self.file_path, params)
+        except QueryError as exc:
+            raise tornado.web.HTTPError(400, reason=str(exc))
+        mime, extension = export.FORMATS[export_format]
+        self.set_header('Content-Type', mime)
+        self.set_header('Content-Disposition', export.content_disposition(f'{file_stem}{extension}'))
+        self.set_header('X-Dataset-Version', source_version(self.file_path))
+
+        chunks = export.encode(batches, export_format)
+        loop = tornado.ioloop.IOLoop.current()
+        while True:
+            chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            if chunk is None:
+                break
+            self.write(chunk)
+            await self.flush()
+
+
+def company_export(file_path, params):
+    name = params.get('name')
+    if not name:
+        raise QueryError('name is required')
+    return export.company_batches(name, _date_range(params), file_path), f'{name}-emissions'
+
+
+def location_export(file_path, params):
+    state = params.get('state')
+    if not state:
+        raise QueryError('state is required')
+    city = params.get('city')
+    return export.location_batches(state, city, file_path), f'{state}-{city or "all"}-emissions'
+
+
+class VersionHandler(tornado.web.RequestHandler):
+    def initialize(self, file_path):
+        self.file_path = file_path
+
+    def get(self):
+        self.write({'version': source_version(self.file_path)})
+
+
+# Routes: GET /version, /rollup?name=sector&limit=10,
+# /company?name=...&start=2010&end=2022&gas=CO2, /suggest?q=..., /location?state=TX&city=...,
+# and POST /companies {"names": [...], ...}, /compare {"names": [...], ...},
+# /locations {"states": [...], ...}; streaming downloads of the page views at
+# /export/company?name=...&start=...&end=...&format=csv|parquet and
+# /export/location?state=TX&city=...&format=csv|parquet
+def make_app(file_path=DATA_PATH, cache=None, executor=None):
+    cache = cache or ResponseCache()
+    executor = executor or ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='emissions-api')
+    routes = [(r'/version', VersionHandler, {'file_path': file_path})]
+    for path, query, validate in [('rollup', rollup, rollup_params), ('company', company, company_params),
+                                  ('companies', companies, companies_params), ('compare', compare, companies_params),
+                                  ('suggest', suggest, suggest_params), ('location', location, location_params),
+                                  ('locations', locations, locations_params)]:
+        routes.append((rf'/{path}', QueryHandler, {'query': query, 'validate': validate, 'file_path': file_path,
+                                                   'cache': cache, 'executor': executor}))
+    for path, batches in [('company', company_export), ('location', location_export)]:
+        routes.append((rf'/export/{path}', ExportHandler,
+                       {'batches': batches, 'file_path': file_path, 'executor': executor}))
+    return tornado.web.Application(routes)
+
+
+# python -m utils.query_service [--port 8502] [--host 127.0.0.1] [--data path]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP/JSON API over the emissions aggregations')
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--data', default=DATA_PATH, help='CSV, Parquet file or columnar store to serve')
+    args = parser.parse_args()
+
+    make_app(args.data).listen(args.port, address=args.host)
+    print(f'Serving {args.data} on http://{args.host}:{args.port}')
+    tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from utils.data_store import lookup_dataset
+
+
+# Per-state row-offset index over a dataset: the rows of each state are one
+# slice of a stable ordering, and each state's sorted city list is kept as metadata
+class StatePartitions:
+    def __init__(self, data):
+        states = data['State']
+        if not isinstance(states.dtype, pd.CategoricalDtype):
+            states = states.astype('category')
+        codes = states.cat.codes.to_numpy()
+        self._order = np.argsort(codes, kind='stable')
+        self._offsets = np.searchsorted(codes[self._order], np.arange(len(states.cat.categories) + 1))
+        self._codes = {str(state): code for code, state in enumerate(states.cat.categories)}
+        self._lookup = {state.lower(): state for state in self._codes}
+
+        cities = data['City'].to_numpy()
+        self.states = []
+        self.cities = {}
+        for state, code in sorted(self._codes.items()):
+            rows = self._order[self._offsets[code]:self._offsets[code + 1]]
+            if len(rows):
+                self.states.append(state)
+                self.cities[state] = sorted({str(city) for city in pd.unique(cities[rows]) if not pd.isna(city)})
+
+    # Canonical spelling of state (matched case-insensitively), or None
+    def resolve(self, state):
+        return self._lookup.get(str(state).lower())
+
+    # Positions of the rows of state, in dataset order
+    def rows(self, state):
+        state = self.resolve(state)
+        if state is None:
+            return np.array([], dtype=np.intp)
+        code = self._codes[state]
+        return self._order[self._offsets[code]:self._offsets[code + 1]]
+
+    def partition(self, data, state):
+        return data.take(self.rows(state))
+
+
+# State partitions of a frame loaded through the data store (None otherwise)
+def get_state_partitions(data):
+    dataset = lookup_dataset(data)
+    if dataset is None:
+        return None
+    return dataset.derived('state_partitions', StatePartitions)
@@ -0,0 +1,148 @@
+import json
+import os
+import re
+import shutil
+import zlib
+
+import numpy as np
+
+# Hashed vocabulary size for BM25 postings and width of the hashed embeddings
+VOCABULARY_BUCKETS = 1 << 20
+EMBEDDING_DIM = 256
+BM25_K1 = 1.2
+BM25_B = 0.75
+# BM25 candidates re-ranked by embedding similarity per search
+RERANK_CANDIDATES = 64
+
+_TOKEN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+STOPWORDS = frozenset('a an and are as at be by did do does for from has have how in is it its of on or that the '
+                      'this to was were what when where which who why with'.split())
+
+_ARRAYS = ['indptr', 'postings', 'frequencies', 'idf', 'lengths', 'embeddings', 'text_offsets']
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(str(text).lower()) if token not in STOPWORDS]
+
+
+# Stable across processes, unlike hash(), so indexes can be shared on disk
+def _bucket(feature, buckets):
+    return zlib.crc32(feature.encode()) % buckets
+
+
+# Signed feature hashing of unigrams and bigrams, L2-normalized, so similar
+# wordings land close together without a trained model
+def embed(text, dim=EMBEDDING_DIM):
+    tokens = tokenize(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]:
+        code = zlib.crc32(feature.encode())
+        vector[code % dim] += 1.0 if code & (1 << 31) else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Write the index of (title, text) documents to directory: CSR postings per
+# hashed term with term frequencies, BM25 idf and document lengths, float16
+# embeddings and the document texts. Written to a temporary directory first
+# and swapped in, so readers never see a partial index.
+def build_index(documents, directory, version):
+    tmp = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    terms, docs, lengths = [], [], np.zeros(len(documents), dtype=np.float32)
+    embeddings = np.zeros((len(documents), EMBEDDING_DIM), dtype=np.float16)
+    for doc, (title, text) in enumerate(documents):
+        tokens = tokenize(f'{title} {text}')
+        lengths[doc] = len(tokens)
+        terms.extend(_bucket(token, VOCABULARY_BUCKETS) for token in tokens)
+        docs.extend([doc] * len(tokens))
+        embeddings[doc] = embed(f'{title} {text}')
+
+    # Collapse repeated (term, doc) pairs into term frequencies, ordered by term
+    pairs = np.unique(np.array(terms, dtype=np.int64) * len(documents) + np.array(docs, dtype=np.int64),
+                      return_counts=True)
+    term_of, doc_of = np.divmod(pairs[0], max(len(documents), 1))
+    document_frequency = np.bincount(term_of, minlength=VOCABULARY_BUCKETS)
+    arrays = {
+        'indptr': np.concatenate([[0], np.cumsum(document_frequency)]).astype(np.int64),
+        'postings': doc_of.astype(np.int32),
+        'frequencies': pairs[1].astype(np.float32),
+        'idf': np.log1p((len(documents) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32),
+        'lengths': lengths,
+        'embeddings': embeddings,
+    }
+    encoded = [json.dumps([title, text]).encode() for title, text in documents]
+    arrays['text_offsets'] = np.concatenate([[0], np.cumsum([len(item) for item in encoded])]).astype(np.int64)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f'{name}.npy'), array)
+    with open(os.path.join(tmp, 'texts.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    # Written last so a partially written directory is never picked up
+    with open(os.path.join(tmp, 'VERSION'), 'w') as f:
+        f.write(version)
+
+    old = f'{directory}.old-{os.getpid()}'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def index_version(directory):
+    try:
+        with open(os.path.join(directory, 'VERSION')) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# Read-only view of an index directory. Arrays are memory-mapped, so every
+# process serving the same index shares one copy through the page cache.
+class TextIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.version = index_version(directory)
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        self._texts = np.memmap(os.path.join(directory, 'texts.bin'), dtype=np.uint8, mode='r') \
+            if self.text_offsets[-1] else np.zeros(0, dtype=np.uint8)
+        average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+        self._length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(average_length, 1e-9))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def document(self, doc):
+        start, stop = self.text_offsets[doc], self.text_offsets[doc + 1]
+        return tuple(json.loads(self._texts[start:stop].tobytes()))
+
+    def bm25(self, query):
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in {_bucket(token, VOCABULARY_BUCKETS) for token in tokenize(query)}:
+            start, stop = self.indptr[term], self.indptr[term + 1]
+            docs, tf = self.postings[start:stop], self.frequencies[start:stop]
+            scores[docs] += self.idf[term] * tf * (BM25_K1 + 1) / (tf + self._length_norm[docs])
+        return scores
+
+    # Top k documents as (doc, score, title, text). BM25 picks the candidates and
+    # embedding similarity re-ranks them; queries sharing no term with the
+    # corpus fall back to a scan of the embeddings.
+    def search(self, query, k=5):
+        if not len(self):
+            return []
+        vector = embed(query)
+        scores = self.bm25(query)
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > RERANK_CANDIDATES:
+            candidates = candidates[np.argpartition(-scores[candidates], RERANK_CANDIDATES)[:RERANK_CANDIDATES]]
+        if len(candidates):
+            similarity = self.embeddings[candidates].astype(np.float32) @ vector
+            combined = scores[candidates] / scores[candidates].max() + similarity
+        else:
+            candidates = np.arange(len(self))
+            combined = self.embeddings.astype(np.float32) @ vector
+        order = np.argsort(-combined, kind='stable')[:k]
+        return [(int(candidates[i]), float(combined[i])) + self.document(int(candidates[i])) for i in order]
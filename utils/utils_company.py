@@ -12,47 +12,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import threading
+from dataclasses import dataclass
+
 import streamlit as st
 import pandas as pd
 import altair as alt
 import plotly.express as px
+from cachetools import LRUCache
+from utils import columnar_store
+from utils.data_store import DATA_PATH, compact_frame, get_data, lookup_dataset, scan, source_derived, source_version
+from utils.emissions_matrix import FramePivot, get_emissions_matrix
+from utils.facility_index import FacilityIndex, get_facility_index
+from utils.figure_cache import altair_lock, cached_chart
+from utils.profiling import profiled
+
+# Selection the Company page opens with
+DEFAULT_COMPANY = 'ABBVIE LTD.'
+DEFAULT_DATE_RANGE = (2010, 2022)
+EMISSION_TYPES = ['CO2', 'CH4', 'N2O']
+
+
+@profiled
+def load_data(file_name=DATA_PATH):
+    return get_data(file_name)
+
+# Rows whose facility name contains company_name (case-insensitive), answered
+# from the facility index when data comes from the data store
+@profiled
+def select_company(data, company_name):
+    index = get_facility_index(data)
+    if index is None:
+        return data[data['Facility.Name'].str.contains(company_name, case=False, na=False, regex=False)]
+    if lookup_dataset(data) is not None:
+        return data.take(index.rows(company_name))
+    return data[index.mask(data['Facility.Name'], company_name)]
 
+# Facility names containing company_name
+@profiled
+def matching_companies(data, company_name):
+    index = get_facility_index(data)
+    if index is None:
+        names = pd.Series(data['Facility.Name'].unique()).dropna()
+        return names[names.str.contains(company_name, case=False, regex=False)].tolist()
+    return index.matching_names(company_name)
 
-def load_data(file_name):
-    data = pd.read_csv(file_name)
-    return data
+# Autocomplete suggestions for the company search box
+@profiled
+def suggest_companies(data, company_name, limit=10):
+    index = get_facility_index(data)
+    if index is None:
+        return matching_companies(data, company_name)[:limit]
+    return index.suggest(company_name, limit)
 
+@profiled
 def filter_data(data, company_name, date_range, emission_type):
     if company_name:
-        data = data[data['Facility.Name'].str.contains(company_name, case=False, na=False)]
+        data = select_company(data, company_name)
     data = data[(data['Year'] >= date_range[0]) & (data['Year'] <= date_range[1])]
     emission_col = f'{emission_type}_emissions'
     filtered_data = data[['Facility.Name', 'Sector', 'Year', emission_col]]
     return data, filtered_data
 
+@profiled
 def pivot_data(filtered_data, emission_type):
     emission_col = f'{emission_type}_emissions'
     pivoted_data = filtered_data.pivot_table(index=['Facility.Name', 'Sector'], 
                                              columns='Year', 
                                              values=emission_col, 
-                                             fill_value=0)
+                                             fill_value=0,
+                                             observed=True)
     return pivoted_data
 
+@profiled
 def calculate_sector_data(data, all_data, company_name, emission_type):
-    selected_company_sector = data.loc[data['Facility.Name'].str.contains(company_name, case=False, na=False), 'Sector'].iloc[0]
+    selected_company_sector = select_company(data, company_name)['Sector'].iloc[0]
     sector_data = all_data[all_data['Sector'] == selected_company_sector]
     emission_col = f'{emission_type}_emissions'
-    total_emissions_by_company = sector_data.groupby('Facility.Name')[emission_col].sum().sort_values(ascending=False)
-    selected_company_emissions = total_emissions_by_company[total_emissions_by_company.index.str.contains(company_name, case=False)]
+    total_emissions_by_company = sector_data.groupby('Facility.Name', observed=True)[emission_col].sum()
+    return rank_sector_companies(total_emissions_by_company, matching_companies(data, company_name), company_name, emission_col)
+
+# Top 10 facilities of a sector plus the selected ones, from per-facility totals
+def rank_sector_companies(total_emissions_by_company, selected_names, company_name, emission_col):
+    total_emissions_by_company = total_emissions_by_company.sort_values(ascending=False)
+    selected_company_emissions = total_emissions_by_company[total_emissions_by_company.index.isin(selected_names)]
     if selected_company_emissions.empty:
         top_companies = total_emissions_by_company.head(10)
     else:
-        top_companies = pd.concat([total_emissions_by_company.head(10), selected_company_emissions]).drop_duplicates()
+        top_companies = pd.concat([total_emissions_by_company.head(10), selected_company_emissions])
+        top_companies = top_companies[~top_companies.index.duplicated()]
     top_companies_df = top_companies.reset_index()
     top_companies_df.columns = ['Facility.Name', emission_col]
     top_companies_df['Highlight'] = top_companies_df['Facility.Name'].apply(lambda x: 'Selected Company' if x == company_name else 'Other Companies')
     return top_companies_df
 
+@profiled
 def calculate_metrics(data, emission_type):
     emission_col = f'{emission_type}_emissions'
     total_emissions = data[emission_col].sum()
@@ -61,29 +116,39 @@ def calculate_metrics(data, emission_type):
     avg_annual_increase = data[emission_col].diff().mean()
     return total_emissions, max_emissions_year, max_emissions_value, avg_annual_increase
 
-def generate_line_chart(data, emission_type):
+@profiled
+def calculate_yearly_emissions(data, emission_type):
+    emission_col = f'{emission_type}_emissions'
+    return data.groupby('Year').agg({emission_col: 'sum'}).reset_index()
+
+@profiled
+@cached_chart('company.yearly_line')
+def generate_line_chart(emission_data, emission_type):
     emission_col = f'{emission_type}_emissions'
-    emission_data = data.groupby('Year').agg({emission_col: 'sum'}).reset_index()
-
-    # Customizing the line chart
-    line_chart = alt.Chart(emission_data).mark_line(point=True).encode(
-        x=alt.X('Year:O', axis=alt.Axis(title='Year', labelAngle=-45)),  # Orienting year labels for better readability
-        y=alt.Y(f'{emission_col}:Q', axis=alt.Axis(title=f'Emissions (Metric Tons)')),  # Adding units to the y-axis title
-        tooltip=[alt.Tooltip('Year:O', title='Year'), alt.Tooltip(f'{emission_col}:Q', title='Emissions (Metric Tons)')],  # Adding units to the tooltip
-        color=alt.value('steelblue'),  # Setting a consistent color for the line
-    ).properties(
-        title=f'Annual {emission_type} Emissions Over Time',
-        width=600,  # Adjusting the width for better visibility
-        height=400  # Adjusting the height for better visibility
-    ).configure_axis(
-        grid=False  # Removing the grid for a cleaner look
-    ).configure_view(
-        strokeWidth=0  # Removing the border around the chart
-    )
+
+    # Altair validates the spec as it is built, against process-wide state
+    with altair_lock:
+        # Customizing the line chart
+        line_chart = alt.Chart(emission_data).mark_line(point=True).encode(
+            x=alt.X('Year:O', axis=alt.Axis(title='Year', labelAngle=-45)),  # Orienting year labels for better readability
+            y=alt.Y(f'{emission_col}:Q', axis=alt.Axis(title=f'Emissions (Metric Tons)')),  # Adding units to the y-axis title
+            tooltip=[alt.Tooltip('Year:O', title='Year'), alt.Tooltip(f'{emission_col}:Q', title='Emissions (Metric Tons)')],  # Adding units to the tooltip
+            color=alt.value('steelblue'),  # Setting a consistent color for the line
+        ).properties(
+            title=f'Annual {emission_type} Emissions Over Time',
+            width=600,  # Adjusting the width for better visibility
+            height=400  # Adjusting the height for better visibility
+        ).configure_axis(
+            grid=False  # Removing the grid for a cleaner look
+        ).configure_view(
+            strokeWidth=0  # Removing the border around the chart
+        )
 
     return line_chart
 
 
+@profiled
+@cached_chart('company.sector_bar')
 def generate_bar_chart(top_companies_df, emission_type, company_name):
     emission_col = f'{emission_type}_emissions'
     fig = px.bar(top_companies_df, x='Facility.Name', y=emission_col,
@@ -95,14 +160,252 @@ def generate_bar_chart(top_companies_df, emission_type, company_name):
     return fig
 
 
+@profiled
 def calculate_average_emissions(data, sector_data, company_name, emission_type, date_range):
     emission_col = f'{emission_type}_emissions'
 
     # Calculate average emissions for the selected company over the selected year range
-    company_avg_emissions = data[(data['Facility.Name'].str.contains(company_name, case=False, na=False)) &
-                                 (data['Year'] >= date_range[0]) & (data['Year'] <= date_range[1])][emission_col].mean()
+    company_data = select_company(data, company_name)
+    company_avg_emissions = company_data[(company_data['Year'] >= date_range[0]) & (company_data['Year'] <= date_range[1])][emission_col].mean()
 
     # Calculate sector average emissions over the selected year range
     sector_avg_emissions = sector_data[(sector_data['Year'] >= date_range[0]) & (sector_data['Year'] <= date_range[1])][emission_col].mean()
 
     return company_avg_emissions, sector_avg_emissions
+
+
+# Everything the company dashboard shows for one (company, year range, gas) selection
+@dataclass(frozen=True)
+class CompanyAnalysis:
+    data: pd.DataFrame
+    pivot: pd.DataFrame
+    metrics: tuple
+    top_companies: pd.DataFrame
+    company_avg_emissions: float
+    sector_avg_emissions: float
+    yearly: pd.DataFrame
+
+
+ANALYSIS_CACHE_SIZE = 256
+
+_analysis_cache = LRUCache(maxsize=ANALYSIS_CACHE_SIZE)
+_analysis_lock = threading.Lock()
+
+
+def _compute_company_analysis(all_data, company_name, date_range, emission_type):
+    emission_col = f'{emission_type}_emissions'
+    data, filtered_data = filter_data(all_data, company_name, date_range, emission_type)
+    matrix = get_emissions_matrix(all_data)
+    if matrix is not None:
+        # Slice the prebuilt facility x year matrix instead of pivoting the rows
+        pivot = matrix.pivot(get_facility_index(all_data).match_ids(company_name), date_range, emission_type)
+    else:
+        pivot = FramePivot(pivot_data(filtered_data, emission_type))
+    yearly = calculate_yearly_emissions(data, emission_type)
+    if data.empty:
+        empty_top = pd.DataFrame(columns=['Facility.Name', emission_col, 'Highlight'])
+        return CompanyAnalysis(data, pivot, None, empty_top, float('nan'), float('nan'), yearly)
+
+    sector = data['Sector'].iloc[0]
+    # From the selected rows, which (unlike the matrix) include rows without a sector
+    company_avg_emissions = data[emission_col].mean()
+    if pd.isna(sector):
+        # No row matches a missing sector, so there is no ranking or sector average
+        totals = pd.Series(dtype=float)
+        sector_avg_emissions = float('nan')
+    elif matrix is not None:
+        # Year-range totals come from the matrix's cumulative sums, so moving
+        # the slider never rescans the sector's rows
+        totals = matrix.sector_facility_totals(emission_col, sector)
+        sector_avg_emissions = _ratio(*matrix.sector_range_totals(emission_col, sector, date_range))
+    else:
+        # One groupby over the selected company's sector gives both the all-years
+        # facility ranking and the year-range sector average
+        sector_data = all_data[all_data['Sector'] == sector]
+        by_facility_year = sector_data.groupby(['Facility.Name', 'Year'], observed=True)[emission_col].agg(['sum', 'count'])
+        totals = by_facility_year['sum'].groupby(level='Facility.Name', observed=True).sum()
+        years = by_facility_year.index.get_level_values('Year')
+        in_range = by_facility_year[(years >= date_range[0]) & (years <= date_range[1])]
+        sector_avg_emissions = _ratio(in_range['sum'].sum(), in_range['count'].sum())
+    top_companies = rank_sector_companies(totals, matching_companies(data, company_name), company_name, emission_col)
+
+    return CompanyAnalysis(data, pivot, calculate_metrics(data, emission_type), top_companies,
+                           company_avg_emissions, sector_avg_emissions, yearly)
+
+
+# Mean from a sum and a count, NaN when there is nothing to average
+def _ratio(total, count):
+    return float(total) / int(count) if count else float('nan')
+
+
+def _memoized_analysis(key, compute):
+    with _analysis_lock:
+        analysis = _analysis_cache.get(key)
+    if analysis is None:
+        analysis = compute()
+        with _analysis_lock:
+            _analysis_cache[key] = analysis
+    return analysis
+
+
+# Company dashboard results, memoized per dataset version and selection so
+# repeated widget interactions across sessions are served from the cache
+@profiled
+def analyze_company(all_data, company_name, date_range, emission_type):
+    dataset = lookup_dataset(all_data)
+    if dataset is None:
+        return _compute_company_analysis(all_data, company_name, date_range, emission_type)
+
+    key = (dataset.path, dataset.version, company_name, tuple(date_range), emission_type)
+    return _memoized_analysis(key, lambda: _compute_company_analysis(all_data, company_name, date_range, emission_type))
+
+
+def _store_facilities(file_path):
+    return compact_frame(columnar_store.read_facilities(file_path))
+
+
+# The store's facility table and its search index, rebuilt only when a refresh
+# changes the set of facilities
+def _store_facility_table(file_path):
+    return source_derived(file_path, 'facilities', _store_facilities, columnar_store.facilities_version(file_path))
+
+
+def _store_facility_index(file_path):
+    return source_derived(file_path, 'facility_index',
+                          lambda path: FacilityIndex(_store_facility_table(path)['Facility.Name']),
+                          columnar_store.facilities_version(file_path))
+
+
+# Search box suggestions for a source; columnar stores answer from their facility table
+@profiled
+def load_company_suggestions(company_name, file_path=DATA_PATH, limit=10):
+    if columnar_store.is_store(file_path):
+        return _store_facility_index(file_path).suggest(company_name, limit)
+    return suggest_companies(load_data(file_path), company_name, limit)
+
+
+# Company dashboard for a source. A columnar store only reads the sectors the
+# matching facilities report under, which is all the analysis needs.
+@profiled
+def load_company_analysis(company_name, date_range, emission_type, file_path=DATA_PATH):
+    if not columnar_store.is_store(file_path):
+        return analyze_company(load_data(file_path), company_name, date_range, emission_type)
+
+    def compute():
+        facilities = _store_facility_table(file_path)
+        names = _store_facility_index(file_path).matching_names(company_name)
+        sectors = facilities.loc[facilities['Facility.Name'].isin(names), 'Sector'].astype(str).unique().tolist()
+        return _compute_company_analysis(scan(file_path, sectors=sectors), company_name, date_range, emission_type)
+
+    key = (os.path.abspath(file_path), source_version(file_path), company_name, tuple(date_range), emission_type)
+    return _memoized_analysis(key, compute)
+
+
+# Most facilities the comparison mode draws as small multiples
+COMPARE_LIMIT = 48
+
+
+# Yearly series, metrics and sector standing of several facilities at once
+@dataclass(frozen=True)
+class CompanyComparison:
+    yearly: pd.DataFrame
+    metrics: pd.DataFrame
+
+
+# All-years totals of every (sector, facility) pair, from the emissions matrix
+# when the dataset has one, otherwise from one groupby over the rows
+def _sector_facility_totals(all_data, emission_col):
+    matrix = get_emissions_matrix(all_data)
+    if matrix is not None:
+        totals = pd.Series(matrix.range_totals(emission_col)[0], index=matrix.facilities)
+        return totals.reorder_levels(['Sector', 'Facility.Name'])
+    return all_data.groupby(['Sector', 'Facility.Name'], observed=True)[emission_col].sum()
+
+
+def _compute_company_comparison(all_data, names, date_range, emission_type):
+    emission_col = f'{emission_type}_emissions'
+    index = get_facility_index(all_data)
+    if index is not None and lookup_dataset(all_data) is not None:
+        selected = all_data.take(index.rows_of(index.name_ids(names)))
+    else:
+        selected = all_data[all_data['Facility.Name'].isin(names)]
+    data = selected[(selected['Year'] >= date_range[0]) & (selected['Year'] <= date_range[1])]
+    facility = data['Facility.Name'].astype(str)
+
+    # One groupby over the selected rows gives every facility's calculate_metrics
+    # numbers; diff() runs within each facility, as it does for a single company
+    values = data[emission_col]
+    grouped = values.groupby(facility)
+    present = values.notna()
+    max_rows = values[present].groupby(facility[present]).idxmax()
+    metrics = pd.DataFrame({
+        'total_emissions': grouped.sum(),
+        'max_emissions_year': data.loc[max_rows, 'Year'].set_axis(max_rows.index),
+        'max_emissions_value': grouped.max(),
+        'avg_annual_increase': grouped.diff().groupby(facility).mean(),
+        'avg_emissions': grouped.mean(),
+    })
+    metrics.index.name = 'Facility.Name'
+
+    # Rank within each sector by all-years totals, like the single-company bar
+    # chart; facilities reporting under several sectors keep their largest one
+    totals = _sector_facility_totals(all_data, emission_col)
+    ranks = pd.DataFrame({
+        'sector_total': totals,
+        'sector_rank': totals.groupby(level='Sector', observed=True).rank(ascending=False, method='min').astype(int),
+        'sector_facilities': totals.groupby(level='Sector', observed=True).transform('size'),
+    }).reset_index()
+    ranks = ranks[ranks['Facility.Name'].isin(metrics.index)]
+    ranks = ranks.sort_values('sector_total', ascending=False).drop_duplicates('Facility.Name')
+    ranks = ranks.assign(**{'Facility.Name': ranks['Facility.Name'].astype(str), 'Sector': ranks['Sector'].astype(str)})
+    metrics = metrics.join(ranks.set_index('Facility.Name')[['Sector', 'sector_rank', 'sector_facilities']])
+    metrics = metrics.sort_values('total_emissions', ascending=False).reset_index()
+
+    yearly = data.groupby([facility, data['Year']])[emission_col].sum().reset_index()
+    return CompanyComparison(yearly, metrics)
+
+
+# Comparison of the named facilities for a source, memoized like single analyses.
+# A columnar store only reads the sectors the facilities report under.
+@profiled
+def load_company_comparison(names, date_range, emission_type, file_path=DATA_PATH):
+    names = tuple(sorted(set(names)))
+    if columnar_store.is_store(file_path):
+        def compute():
+            facilities = _store_facility_table(file_path)
+            sectors = facilities.loc[facilities['Facility.Name'].isin(names), 'Sector'].astype(str).unique().tolist()
+            return _compute_company_comparison(scan(file_path, sectors=sectors), names, date_range, emission_type)
+    else:
+        def compute():
+            return _compute_company_comparison(load_data(file_path), names, date_range, emission_type)
+
+    key = (os.path.abspath(file_path), source_version(file_path), 'compare', names, tuple(date_range), emission_type)
+    return _memoized_analysis(key, compute)
+
+
+# Facility names matching a search, for picking the facilities to compare
+@profiled
+def load_matching_companies(query, file_path=DATA_PATH):
+    if columnar_store.is_store(file_path):
+        return _store_facility_index(file_path).matching_names(query)
+    return matching_companies(load_data(file_path), query)
+
+
+# One small line chart per facility, laid out as a grid of facets
+@profiled
+@cached_chart('company.small_multiples')
+def generate_small_multiples(yearly, emission_type, columns=4):
+    emission_col = f'{emission_type}_emissions'
+    n_rows = -(-yearly['Facility.Name'].nunique() // columns)
+    fig = px.line(yearly, x='Year', y=emission_col, facet_col='Facility.Name', facet_col_wrap=columns,
+                  markers=True, facet_row_spacing=min(0.08, 0.5 / max(n_rows, 1)),
+                  labels={emission_col: 'Emissions'}, title=f'Annual {emission_type} Emissions by Facility')
+    fig.for_each_annotation(lambda annotation: annotation.update(text=annotation.text.split('=', 1)[-1]))
+    fig.update_yaxes(matches=None, showticklabels=True)
+    fig.update_layout(height=max(300, 220 * n_rows), showlegend=False)
+    return fig
+
+
+def clear_analysis_cache():
+    with _analysis_lock:
+        _analysis_cache.clear()
@@ -1,16 +1,27 @@
 import plotly.express as px
 import streamlit as st
 import pandas as pd
+from utils.aggregates import get_aggregates
+from utils.data_store import DATA_PATH, get_data
+from utils.figure_cache import cached_chart
+from utils.profiling import profiled
+
+# Load the data (shared across sessions by the data store)
+@profiled
+def load_data(file_path=DATA_PATH):
+    return get_data(file_path)
+
+# Load the precomputed summary tables the Home charts are drawn from
+@profiled
+def load_aggregates(file_path=DATA_PATH):
+    return get_aggregates(file_path)
+
+@profiled
+@cached_chart('home.top_sectors')
+def create_top_sectors_pie_chart(aggregates):
+    # CO2 equivalent emissions by Sector
+    emissions_by_sector = aggregates['sector'][['Sector', 'CO2_eq_emissions']]
 
-# Load the data
-def load_data(file_path):
-    data = pd.read_csv(file_path)
-    return data
-
-def create_top_sectors_pie_chart(data):
-    # Summarize CO2 equivalent emissions by Sector
-    emissions_by_sector = data.groupby('Sector')['CO2_eq_emissions'].sum().reset_index()
-    
     # Filter for the top 10 sectors by CO2 equivalent emissions
     top_sectors = emissions_by_sector.nlargest(10, 'CO2_eq_emissions')
 
@@ -36,15 +47,14 @@ def create_top_sectors_pie_chart(data):
     return fig
 
 
-def create_emissions_trend_chart(data):
-    # Aggregate emissions by year
-    emissions_trend = data.groupby('Year').agg({
-        'CO2_eq_emissions': 'sum',
-        'CO2_emissions': 'sum'
-    }).reset_index()
+@profiled
+@cached_chart('home.emissions_trend')
+def create_emissions_trend_chart(aggregates):
+    # Emissions by year
+    emissions_trend = aggregates['year'][['Year', 'CO2_eq_emissions', 'CO2_emissions']]
 
     # Rename 'CO2_eq_emissions' to 'Total Emissions' for clarity in the chart
-    emissions_trend.rename(columns={'CO2_eq_emissions': 'Total Emissions'}, inplace=True)
+    emissions_trend = emissions_trend.rename(columns={'CO2_eq_emissions': 'Total Emissions'})
 
     # Create the line chart
     fig = px.line(emissions_trend, 
@@ -69,9 +79,11 @@ def create_emissions_trend_chart(data):
     return fig
 
 
-def create_state_wise_emissions_map(data):
-    # Summarize CO2 equivalent emissions by State
-    emissions_by_state = data.groupby('State')['CO2_eq_emissions'].sum().reset_index()
+@profiled
+@cached_chart('home.state_map')
+def create_state_wise_emissions_map(aggregates):
+    # CO2 equivalent emissions by State
+    emissions_by_state = aggregates['state'][['State', 'CO2_eq_emissions']]
 
     # Create a choropleth map for state-wise emissions
     fig = px.choropleth(emissions_by_state,
@@ -100,9 +112,11 @@ def create_state_wise_emissions_map(data):
     return fig
 
 
-def create_top_emitters_bar_chart(data):
-    # Identify the top emitting facilities
-    top_emitting_facilities = data.groupby(['Facility.Name', 'City', 'State'])['CO2_eq_emissions'].sum().reset_index().sort_values(by='CO2_eq_emissions', ascending=False).head(10)
+@profiled
+@cached_chart('home.top_emitters')
+def create_top_emitters_bar_chart(aggregates):
+    # Identify the top emitting facilities (the facility rollup is sorted by emissions)
+    top_emitting_facilities = aggregates['facility'].head(10)
 
     # Create a bar chart for top emitting facilities
     fig = px.bar(top_emitting_facilities, 
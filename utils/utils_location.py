@@ -1,35 +1,91 @@
-import streamlit as st
+import os
+
+import numpy as np
 import pandas as pd
 import plotly.express as px
+from utils import columnar_store
+from utils.data_store import DATA_PATH, get_data, scan, source_derived
+from utils.figure_cache import cached_chart
+from utils.profiling import profiled
+from utils.state_partitions import get_state_partitions
+
+# Load the data (shared across sessions by the data store)
+@profiled
+def load_data(file_path=DATA_PATH):
+    return get_data(file_path)
+
+# Sorted states and state -> sorted cities for the location filters
+@profiled
+def location_options(df):
+    partitions = get_state_partitions(df)
+    if partitions is not None:
+        return partitions.states, partitions.cities
+    states = sorted(df['State'].dropna().unique())
+    cities = {state: sorted(df.loc[df['State'] == state, 'City'].dropna().unique()) for state in states}
+    return states, cities
+
+def _store_location_options(file_path):
+    facilities = columnar_store.read_facilities(file_path)
+    states = sorted(facilities['State'].dropna().unique())
+    cities = {state: sorted(rows['City'].dropna().unique()) for state, rows in facilities.groupby('State')}
+    return states, cities
+
+# Location filter options for a source; columnar stores answer from their facility table
+@profiled
+def load_location_options(file_path=DATA_PATH):
+    if columnar_store.is_store(file_path):
+        return source_derived(file_path, 'location_options', _store_location_options,
+                              columnar_store.facilities_version(file_path))
+    return location_options(load_data(file_path))
+
+# Rows for a state (and optionally a city); columnar stores read only that state's rows
+@profiled
+def load_location_data(state, city=None, file_path=DATA_PATH):
+    if columnar_store.is_store(file_path):
+        return filter_data(scan(file_path, states=[state]), city=city)
+    return filter_data(load_data(file_path), city=city, state=state)
 
-# Load the data
-def load_data(file_path):
-    data = pd.read_csv(file_path)
-    return data
+# Case-insensitive equality mask, comparing categories rather than every row when possible
+def _matches(column, value):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories
+        matching = np.flatnonzero(categories.str.lower() == value.lower())
+        return np.isin(column.cat.codes.to_numpy(), matching)
+    return (column.str.lower() == value.lower()).to_numpy()
 
 # Filter data based on city and/or state
+@profiled
 def filter_data(df, city=None, state=None):
+    partitions = get_state_partitions(df) if state else None
+    if partitions is not None:
+        # Read only the selected state's partition
+        df = partitions.partition(df, state)
+        state = None
     if city and state:
-        filtered_df = df[(df['City'].str.lower() == city.lower()) & (df['State'].str.lower() == state.lower())]
+        filtered_df = df[_matches(df['City'], city) & _matches(df['State'], state)]
     elif city:
-        filtered_df = df[df['City'].str.lower() == city.lower()]
+        filtered_df = df[_matches(df['City'], city)]
     elif state:
-        filtered_df = df[df['State'].str.lower() == state.lower()]
+        filtered_df = df[_matches(df['State'], state)]
     else:
         filtered_df = df
     return filtered_df
 
 # Plot CO2 emissions by year using Plotly
-def plot_co2_emissions_by_year(df):
+@profiled
+@cached_chart('location.co2_by_year')
+def build_co2_emissions_by_year(df):
     emissions_by_year = df.groupby('Year')['CO2_emissions'].sum().reset_index()
     fig = px.bar(emissions_by_year, x='Year', y='CO2_emissions', 
                  labels={'CO2_emissions': 'Total CO2 Emissions'}, 
                  title='Total CO2 Emissions by Year')
     fig.update_layout(xaxis_title='Year', yaxis_title='Total CO2 Emissions')
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
 # Plot distribution of emissions types using Plotly
-def plot_emissions_distribution(df):
+@profiled
+@cached_chart('location.distribution')
+def build_emissions_distribution(df):
     total_co2 = df['CO2_emissions'].sum()
     total_methane = df['CH4_emissions'].sum()
     total_nitrous_oxide = df['N2O_emissions'].sum()
@@ -40,22 +96,77 @@ def plot_emissions_distribution(df):
     fig = px.pie(emissions, names='Emissions Type', values='Total', 
                  title='Distribution of Emissions Types', 
                  color_discrete_sequence=px.colors.qualitative.Pastel)
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
 # Plot emissions by sector using Plotly (no change needed)
-def plot_emissions_by_sector(df):
-    emissions_by_sector = df.groupby('Sector')['CO2_emissions'].sum().reset_index()
+@profiled
+@cached_chart('location.by_sector')
+def build_emissions_by_sector(df):
+    emissions_by_sector = df.groupby('Sector', observed=True)['CO2_emissions'].sum().reset_index()
+    # Plotly regroups by path itself, so drop the dataset-wide sector categories
+    emissions_by_sector['Sector'] = emissions_by_sector['Sector'].astype(str)
     fig = px.sunburst(emissions_by_sector, path=['Sector'], values='CO2_emissions',
                       color='CO2_emissions', hover_data=['Sector'],
                       color_continuous_scale='RdBu',
                       title='Emissions Breakdown by Sector')
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+# Above this many rows the scatter switches to per-facility points drawn with WebGL
+SCATTER_POINT_LIMIT = int(os.environ.get('EMISSIONS_SCATTER_POINT_LIMIT', 5000))
+
+# Split max_points across groups in proportion to their sizes, by largest
+# remainder, so the shares add up to exactly max_points
+def _share_budget(sizes, max_points):
+    quotas = np.asarray(sizes, dtype=float) * max_points / sum(sizes)
+    shares = np.floor(quotas).astype(int)
+    extra = max_points - shares.sum()
+    shares[np.argsort(shares - quotas, kind='stable')[:extra]] += 1
+    return shares
+
+# Reduce the scatter input to at most max_points: one mean point per facility, then
+# a per-sector sample proportional to sector size that keeps each sampled sector's
+# largest CO2 and N2O emitters. Returns the points and the number of facilities.
+@profiled
+def downsample_scatter(df, max_points=SCATTER_POINT_LIMIT):
+    points = df.groupby(['Facility.Name', 'City', 'State', 'Sector'], observed=True)[['CO2_emissions', 'N2O_emissions']].mean().reset_index()
+    n_facilities = len(points)
+    if n_facilities <= max_points:
+        return points, n_facilities
+
+    rng = np.random.default_rng(0)
+    keep = []
+    sectors = list(points.groupby('Sector', observed=True).indices.values())
+    for rows, budget in zip(sectors, _share_budget([len(rows) for rows in sectors], max_points)):
+        if budget == 0:
+            continue
+        n_outliers = max(1, budget // 10)
+        outliers = set()
+        for col in ['CO2_emissions', 'N2O_emissions']:
+            values = points[col].to_numpy()[rows]
+            outliers.update(rows[np.argsort(values)[::-1][:n_outliers]])
+        outliers = np.fromiter(outliers, dtype=rows.dtype)[:budget]
+        rest = np.setdiff1d(rows, outliers)
+        sampled = rng.choice(rest, size=min(len(rest), budget - len(outliers)), replace=False)
+        keep.extend([outliers, sampled])
+    return points.iloc[np.sort(np.concatenate(keep))], n_facilities
+
+# Build the dynamic scatter comparing CO2 and N2O emissions
+@profiled
+@cached_chart('location.scatter')
+def build_dynamic_scatter(df, max_points=SCATTER_POINT_LIMIT):
+    title = 'CO2 vs. N2O Emissions by Sector'
+    render_mode = 'auto'
+    if len(df) > max_points:
+        # Keep the payload bounded for large selections
+        df, n_facilities = downsample_scatter(df, max_points)
+        title = f'{title} (mean per facility, {len(df):,} of {n_facilities:,} facilities)'
+        render_mode = 'webgl'
+    # One trace per sector present in the selection, not per dataset-wide category
+    df = df.assign(Sector=df['Sector'].astype(str))
 
-# Plot dynamic scatter comparing CO2 and N2O emissions
-def plot_dynamic_scatter(df):
     fig = px.scatter(df, x='CO2_emissions', y='N2O_emissions',
                      color='Sector', hover_data=['Facility.Name', 'City', 'State'],
-                     title='CO2 vs. N2O Emissions by Sector')
+                     title=title, render_mode=render_mode)
 
     # Update layout for titles and figure size
     fig.update_layout(
@@ -69,4 +180,4 @@ def plot_dynamic_scatter(df):
         margin=dict(l=20, r=20, t=50, b=80)
     )
 
-    st.plotly_chart(fig, use_container_width=False)  # Set use_container_width to False to use fixed size
+    return fig
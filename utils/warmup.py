@@ -0,0 +1,186 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+from utils import columnar_store
+from utils.data_store import DATA_PATH, source_version
+
+logger = logging.getLogger(__name__)
+
+# Touched once warm-up has finished, for deployments that gate traffic on a
+# readiness probe (e.g. `test -f /tmp/emissions-ready`)
+READY_FILE = os.environ.get('EMISSIONS_READY_FILE')
+# EMISSIONS_WARMUP=0 turns off the background warm-up app.py starts, e.g. to keep
+# a process that only serves one page from importing every chart backend
+WARMUP_ENABLED = os.environ.get('EMISSIONS_WARMUP', '1') != '0'
+
+_ready = threading.Event()
+_status = {'state': 'idle', 'steps': [], 'error': None}
+_status_lock = threading.Lock()
+_thread = None
+
+
+# Plotting libraries and page helpers the first rerun would otherwise import
+def _imports(file_path):
+    import altair  # noqa: F401
+    import plotly.express  # noqa: F401
+    from utils import utils_company, utils_home, utils_location  # noqa: F401
+
+
+def _home_charts(file_path):
+    from utils import utils_home
+
+    aggregates = utils_home.load_aggregates(file_path)
+    version = source_version(file_path)
+    # Same cache keys as app.main, so the first visit is a figure cache hit
+    utils_home.create_top_sectors_pie_chart(aggregates, cache_key=version)
+    utils_home.create_emissions_trend_chart(aggregates, cache_key=version)
+    utils_home.create_state_wise_emissions_map(aggregates, cache_key=version)
+    utils_home.create_top_emitters_bar_chart(aggregates, cache_key=version)
+
+
+def _default_company(file_path):
+    from utils import utils_company
+
+    company, date_range, emission_type = (utils_company.DEFAULT_COMPANY, utils_company.DEFAULT_DATE_RANGE,
+                                          utils_company.EMISSION_TYPES[0])
+    utils_company.load_company_suggestions(company, file_path)
+    analysis = utils_company.load_company_analysis(company, date_range, emission_type, file_path)
+    if analysis.data.empty:
+        return
+    # Same cache key as pages.company.show
+    chart_key = (source_version(file_path), company, tuple(date_range))
+    utils_company.generate_line_chart(analysis.yearly, emission_type, cache_key=chart_key)
+    utils_company.generate_bar_chart(analysis.top_companies, emission_type, company, cache_key=chart_key)
+
+
+def _location_options(file_path):
+    from utils import utils_location
+    from utils.state_partitions import get_state_partitions
+
+    utils_location.load_location_options(file_path)
+    if not columnar_store.is_store(file_path):
+        get_state_partitions(utils_location.load_data(file_path))
+
+
+# Clusters behind the Location page's facility map
+def _map_layers(file_path):
+    from utils.maps import get_map_layers
+
+    get_map_layers(file_path)
+
+
+def _load_dataset(file_path):
+    # Columnar stores are scanned per request, there is no full table to load
+    if not columnar_store.is_store(file_path):
+        from utils.utils_home import load_data
+        load_data(file_path)
+
+
+# Warm-up steps in order; each leaves its result in the process-wide caches
+STEPS = [
+    ('imports', _imports),
+    ('dataset', _load_dataset),
+    ('home', _home_charts),
+    ('company', _default_company),
+    ('location', _location_options),
+    ('map', _map_layers),
+]
+
+
+def _set_status(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+
+# Run every warm-up step in the calling thread and signal readiness
+def run(file_path=DATA_PATH):
+    _set_status(state='running', steps=[], error=None)
+    start = time.perf_counter()
+    try:
+        for name, step in STEPS:
+            step_start = time.perf_counter()
+            step(file_path)
+            elapsed_ms = (time.perf_counter() - step_start) * 1000
+            with _status_lock:
+                _status['steps'].append({'step': name, 'wall_ms': elapsed_ms})
+            logger.info('warm-up %s: %.0f ms', name, elapsed_ms)
+    except Exception as exc:
+        _set_status(state='failed', error=repr(exc))
+        logger.exception('warm-up failed')
+        raise
+    finally:
+        _ready.set()
+
+    _set_status(state='ready', wall_ms=(time.perf_counter() - start) * 1000)
+    if READY_FILE:
+        with open(READY_FILE, 'w') as f:
+            f.write(source_version(file_path))
+    return status()
+
+
+def _run_in_background(file_path):
+    try:
+        run(file_path)
+    except Exception:
+        # Already recorded in the status; sessions fall back to building on demand
+        pass
+
+
+# Start the warm-up on a daemon thread, once per process
+def start(file_path=DATA_PATH):
+    global _thread
+    with _status_lock:
+        if _thread is None and WARMUP_ENABLED:
+            _thread = threading.Thread(target=_run_in_background, args=(file_path,), name='emissions-warmup',
+                                       daemon=True)
+            _thread.start()
+    return _thread
+
+
+def is_ready():
+    return status()['state'] == 'ready'
+
+
+# Block until the warm-up finished (successfully or not) or timeout elapsed
+def wait(timeout=None):
+    return _ready.wait(timeout)
+
+
+def status():
+    with _status_lock:
+        return {**_status, 'steps': list(_status['steps'])}
+
+
+# python -m utils.warmup             build disk artifacts and report step timings
+# python -m utils.warmup --serve ... warm up in the background of a Streamlit
+#                                    server started in this process
+# Both warm up EMISSIONS_DATA_PATH, the source the app itself reads.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm up the emissions app caches')
+    parser.add_argument('--serve', action='store_true',
+                        help='start a Streamlit server for app.py while warming up in the background')
+    args, streamlit_args = parser.parse_known_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    if args.serve:
+        from streamlit.web import cli
+        # Under -m this file runs as __main__; start the thread of the importable
+        # module so app.py sees the same warm-up state
+        from utils import warmup
+
+        warmup.start()
+        sys.argv = ['streamlit', 'run', 'app.py'] + streamlit_args
+        sys.exit(cli.main())
+
+    try:
+        result = run()
+    except Exception as exc:
+        print(f'warm-up failed: {exc!r}', file=sys.stderr)
+        sys.exit(1)
+    for step in result['steps']:
+        print(f'{step["step"]:<10} {step["wall_ms"]:>10.1f} ms')
+    print(f'{"total":<10} {result["wall_ms"]:>10.1f} ms')